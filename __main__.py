@@ -4,6 +4,7 @@
 # TODO: Better Stub's
 
 from collections.abc import Callable
+from graphlib import TopologicalSorter, CycleError
 from typing import Any, Optional
 import importlib.util
 import importlib
@@ -36,6 +37,9 @@ class MainClient(MetaClient):
         self.config: dict[str, Any] = {}
         self.defby: dict[str, MetaModule] = {}
 
+        # Module identifier -> required module identifiers
+        self.graph: dict[str, tuple[str, ...]] = {}
+
     def require_configuration(
         self, module: MetaModule | MetaClient,
         config: str
@@ -79,6 +83,69 @@ class MainClient(MetaClient):
             output.append(self.modules[module])
         return tuple(output)
 
+    def build_graph(self) -> None:
+        """Builds the dependency graph of the modules (see
+        `MetaModule.requires`), failing on cycles"""
+
+        graph: dict[str, tuple[str, ...]] = {}
+        for identifier, module in self.modules.items():
+            for required in module.requires:
+                if required not in self.modules:
+                    raise MainException(
+                        f'Module `{identifier}` requires `{required}`, '
+                        'which is not installed')
+            graph[identifier] = tuple(module.requires)
+
+        try:
+            TopologicalSorter(graph).prepare()
+
+        except CycleError as e:
+            raise MainException(
+                'Modules dependency cycle: ' +
+                ' -> '.join(f'`{x}`' for x in e.args[1])) from e
+
+        self.graph = graph
+
+    def startup_order(self) -> list[str]:
+        return list(TopologicalSorter(self.graph).static_order())
+
+    async def run_modules(self, step: str) -> None:
+        """Runs a step (`install`, `setup`, `post_install`) of
+        every module, concurrently for the ones that don't depend
+        on each other
+
+        Notes
+        -----
+        The first step that fails cancels the running ones, and
+        its exception is raised
+        """
+
+        sorter: TopologicalSorter = TopologicalSorter(self.graph)
+        sorter.prepare()
+
+        running: dict[asyncio.Task, str] = {}
+        try:
+            while sorter.is_active():
+                for identifier in sorter.get_ready():
+                    logging.debug(
+                        'Running `%s` of `%s` module', step, identifier)
+                    running[asyncio.create_task(getattr(
+                        self.modules[identifier], step)())] = identifier
+
+                done: set[asyncio.Task]
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    identifier: str = running.pop(task)
+                    task.result()
+                    sorter.done(identifier)
+
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
 
 async def _setup() -> MainClient:
     load_dotenv()
@@ -130,6 +197,7 @@ async def _setup() -> MainClient:
 
         bot.modules[module.identifier] = module
 
+    bot.build_graph()
     return bot
 
 
@@ -146,23 +214,15 @@ async def async_run(
     bot: MainClient = await _setup()
     bot.debug = debug_mode
 
-    for v in bot.modules.values():
-        logging.debug(
-            'Installing `%s` module', v.identifier)
-        await v.install()
+    await bot.run_modules('install')
     logging.info('Installed modules!')
     
     if setup_mode:
-        for v in bot.modules.values():
-            logging.debug('Setting up `%s` module', v.identifier)
-            await v.setup()
+        await bot.run_modules('setup')
         logging.info('Setted up all modules!')
         return
 
-    for v in bot.modules.values():
-        logging.debug(
-            'Running post-install of module `%s`', v.identifier)
-        await v.post_install()
+    await bot.run_modules('post_install')
     logging.info('Ran `post-install` method of every module')
 
     logging.info('Starting bot')
@@ -174,6 +234,14 @@ async def async_run(
     logging.info('Idling')
     await idle()
 
+    # In reverse order, as modules depend on the previous ones
+    for identifier in reversed(bot.startup_order()):
+        v: MetaModule = bot.modules[identifier]
+        if hasattr(v, 'shutdown'):
+            logging.debug('Shutting down `%s` module', v.identifier)
+            await v.shutdown()
+    logging.info('Shut down every module')
+
 @cli.command()
 @click.option(
     '--setup', '-s', 'setup_mode',
@@ -189,9 +257,7 @@ async def async_test() -> None:
     bot: MainClient = await _setup()
     bot.require_configuration(bot, 'tests')
 
-    for v in bot.modules.values():
-        logging.debug('Installing `%s` module', v.identifier)
-        await v.install()
+    await bot.run_modules('install')
 
     tests: dict[str, dict[str, list[Callable]]] = {}
     for k in bot.modules.keys():
@@ -237,9 +303,7 @@ async def async_test() -> None:
                     identifier, no, len(tdata['install']))
                 no += 1
 
-    for v in bot.modules.values():
-        logging.debug('Running post-install of `%s` module', v.identifier)
-        await v.post_install()
+    await bot.run_modules('post_install')
 
     for mod, tdata in tests.items():
         if 'post_install' in tdata:
@@ -0,0 +1,124 @@
+from pyrogram.handlers import MessageHandler
+from stub import MetaClient, MetaModule
+from pyrogram.client import Client
+from pyrogram.types import Message
+from typing import Any, Optional
+from pyrogram import filters
+import html
+import stub
+
+
+class Module(MetaModule):
+    """
+    Dumps the lock metrics (see `Lock.lock_stats`)
+
+    `/lockstats` shows the global ones & the chats and handlers
+    that wait for or hold the chat locks the most, `/lockstats
+    <voice_id|handler>` shows the ones of a single scope.
+    """
+
+    i18n: MetaModule
+    ustorage: MetaModule
+    outbound: MetaModule
+
+
+    def __init__(self, client: MetaClient):
+        self.identifier: str = 'Debug.LockStats'
+        self.requires: tuple[str, ...] = ('I18n', 'UStorage', 'Outbound')
+        self.client: MetaClient = client
+
+    async def setup(self) -> None:
+        pass
+
+    async def install(self) -> None:
+        if self.client.debug:
+            self.i18n, self.ustorage, self.outbound = \
+                self.client.require_modules((
+                    'I18n', 'UStorage', 'Outbound'))
+
+            self.client.require_configuration(
+                self, 'superadmin_id')
+
+            self.client.register_configuration(self, {
+                'LockStats_Top': 5
+            })
+
+            self.client.add_handler(MessageHandler(
+                self.ustorage.c11e(
+                    self.lockstats, auto_update=False,
+                    required=False
+                ),
+
+                filters.private &
+                filters.user(self.client.config['superadmin_id']) &
+                filters.command('lockstats')
+            ))
+
+    async def post_install(self) -> None:
+        pass
+
+    def format_ms(self, seconds: float) -> str:
+        return f'{seconds * 1000:.1f}ms'
+
+    def format_hist(self, name: Any, hist: dict[str, Any]) -> str:
+        return (
+            f'{name}: n={hist["count"]} '
+            f'total={hist["total"]:.2f}s '
+            f'p50={self.format_ms(hist["p50"])} '
+            f'p90={self.format_ms(hist["p90"])} '
+            f'p99={self.format_ms(hist["p99"])} '
+            f'max={self.format_ms(hist["max"])}')
+
+    def format_stats(self, name: Any, stats: dict[str, Any]) -> str:
+        out: list[str] = [str(name)]
+        for key in ('wait', 'hold'):
+            out.append('  ' + self.format_hist(key, stats[key]))
+
+        retries: dict[str, Any] = stats['retries']
+        out.append(
+            f'  retries: p90={retries["p90"]:g} max={retries["max"]:g} '
+            f'busy={stats["busy"]} timeouts={stats["timeouts"]} '
+            f'takeovers={stats["takeovers"]}')
+        return '\n'.join(out)
+
+    def dump(self, scope: Optional[str]) -> Optional[str]:
+        if scope:
+            stats: Optional[dict[str, Any]] = \
+                self.ustorage.lock_stats(voice_id=int(scope)) \
+                if scope.lstrip('-').isdigit() \
+                else self.ustorage.lock_stats(owner=scope)
+            return stats and self.format_stats(scope, stats)
+
+        top: int = self.client.config['LockStats_Top']
+        out: list[str] = [
+            self.format_stats('global', self.ustorage.lock_stats())]
+
+        for metric in ('wait', 'hold'):
+            for by in ('chat', 'owner'):
+                out.append(f'\n# top {by}s by {metric}')
+                # A line per entry, so it fits on a single message
+                out.extend(
+                    self.format_hist(key, stats[metric])
+                    for key, stats in self.ustorage.lock_ranking(
+                        metric, by, top))
+        return '\n'.join(out)
+
+    async def lockstats(
+        self, _: Client,
+        message: Message,
+        context: 'stub.Context'
+    ) -> None:
+        scope: Optional[str] = message.command[1] \
+            if len(message.command) > 1 else None
+
+        dump: Optional[str] = self.dump(scope)
+        await self.outbound.call(
+            message.chat.id, self.outbound.Priority.MESSAGE,
+            message.reply,
+            self.i18n[context]['ls_res'].format(html.escape(dump))
+                if dump is not None
+            else self.i18n[context]['ls_none'].format(html.escape(scope)))
+
+
+    def stub(self, root: dict[str, Any]) -> None:
+        pass
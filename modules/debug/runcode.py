@@ -15,10 +15,13 @@ class Module(MetaModule):
     i18n: MetaModule
     goodies: MetaModule
     ustorage: MetaModule
+    outbound: MetaModule
 
 
     def __init__(self, client: MetaClient):
         self.identifier: str = 'Debug.RunCode'
+        self.requires: tuple[str, ...] = (
+            'I18n', 'Goodies', 'UStorage', 'Outbound')
         self.client: MetaClient = client
 
     async def setup(self) -> None:
@@ -26,8 +29,9 @@ class Module(MetaModule):
 
     async def install(self) -> None:
         if self.client.debug:
-            self.i18n, self.goodies, self.ustorage = self.client.require_modules((
-                'I18n', 'Goodies', 'UStorage'))
+            self.i18n, self.goodies, self.ustorage, self.outbound = \
+                self.client.require_modules((
+                    'I18n', 'Goodies', 'UStorage', 'Outbound'))
 
             self.client.require_configuration(
                 self, 'superadmin_id')
@@ -83,13 +87,17 @@ async def entry_point(self):
                 fmt: str = html.escape(html.escape(str(out)))
                 bufout: str = html.escape(html.escape(''.join(buffer)))
 
-                await message.reply(
+                await self.outbound.call(
+                    message.chat.id, self.outbound.Priority.MESSAGE,
+                    message.reply,
                     self.i18n[context]['rc_res'].format(fmt, bufout))
 
         except Exception:
-            await message.reply(self.i18n[context]['rc_exc'].format(
-                traceback.format_exc(),
-            ))
+            await self.outbound.call(
+                message.chat.id, self.outbound.Priority.MESSAGE,
+                message.reply, self.i18n[context]['rc_exc'].format(
+                    traceback.format_exc(),
+                ))
 
 
     def stub(self, root: dict[str, Any]) -> None:
@@ -2,8 +2,15 @@
     Telegram Goodies
 """
 
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime
 from typing import Optional, Any
+import itertools
+import threading
+import logging
+import asyncio
 import re
 
 from pyrogram.errors.exceptions.bad_request_400 import (
@@ -12,6 +19,7 @@ from pyrogram.errors.exceptions.bad_request_400 import (
 )
 
 from pyrogram.types import Message
+from yt_dlp.utils import DownloadError
 from yt_dlp import YoutubeDL
 
 from stub import MetaClient, MetaModule
@@ -20,7 +28,64 @@ import stub
 
 youtube_regex = re.compile(
     r'(?:https?:\/\/)?(?:www\.)?youtu(?:\.be\/|be.com\/\S*(?:watch|embed)(?:(?:(?=\/[-a-zA-Z0-9_]{11,}(?!\S))\/)|(?:\S*v=|v\/)))([-a-zA-Z0-9_]{11,})')
-ytdl: YoutubeDL = YoutubeDL()
+playlist_regex = re.compile(
+    r'(?:https?:\/\/)?(?:www\.|m\.|music\.)?youtu(?:\.be|be\.com)\/\S*[?&]list=([-a-zA-Z0-9_]+)')
+ytdl_params: dict[str, dict[str, Any]] = {
+    'info': {},
+    'media': {
+        'format': 'bestaudio/best',
+        'quiet': True
+    },
+    'playlist': {
+        'extract_flat': 'in_playlist',
+        'noplaylist': False,
+        'quiet': True
+    }
+}
+
+# YoutubeDL instances aren't thread safe, so every worker
+# thread has its own ones
+ytdl_local: threading.local = threading.local()
+
+
+def ytdl_extract(kind: str, url: str, kwargs: dict[str, Any]) -> Any:
+    ytdl: Optional[YoutubeDL] = getattr(ytdl_local, kind, None)
+    if ytdl is None:
+        ytdl = YoutubeDL(ytdl_params[kind])
+        setattr(ytdl_local, kind, ytdl)
+
+    return ytdl.extract_info(url, download=False, **kwargs)
+
+
+def ytdl_playlist(url: str) -> Optional[Iterator[dict[str, Any]]]:
+    # Every playlist has its own instance, as its entries are
+    # pulled later on (maybe from another worker thread)
+    ytdl: YoutubeDL = YoutubeDL(ytdl_params['playlist'])
+    info: dict[str, Any] = ytdl.extract_info(
+        url, download=False, process=False)
+
+    # `watch?v=...&list=...` URLs redirect to the playlist one
+    if info.get('_type') in ('url', 'url_transparent'):
+        info = ytdl.extract_info(
+            info['url'], download=False, process=False,
+            ie_key=info.get('ie_key'))
+
+    if info.get('_type') != 'playlist':
+        return None
+    return iter(info['entries'])
+
+
+def ytdl_take(
+    entries: Iterator[dict[str, Any]], size: int
+) -> list[dict[str, Any]]:
+    return list(itertools.islice(entries, size))
+
+
+class MetadataUnavailable(Exception):
+    """
+    Raised by `Module.song_from_url` when the track metadata
+    can't be fetched (or its last fetch failed recently)
+    """
 
 
 class Module(MetaModule):
@@ -32,24 +97,59 @@ class Module(MetaModule):
 
     i18n: MetaModule
     ustorage: MetaModule
+    outbound: MetaModule
+
+    yt_pool: ThreadPoolExecutor
+    yt_slots: asyncio.Semaphore
 
     def __init__(self, client: MetaClient):
         self.identifier = 'Goodies'
+        self.requires: tuple[str, ...] = ('I18n', 'UStorage', 'Outbound')
         self.client: MetaClient = client
         self.cbkid: int = 0
 
+        self.MetadataUnavailable = MetadataUnavailable
+
+        # log_id -> latest (context, text, kwargs)
+        self.status_pending: dict[
+            int, tuple['stub.Context', str, dict[str, Any]]] = {}
+        self.status_tasks: dict[int, asyncio.Task] = {}
+
     async def setup(self) -> None:
         pass
 
     async def install(self) -> None:
         self.client.register_configuration(self, {
             'Goodies_YTParseName': True,
-            'Goodies_ReportErrorID': -1
+            'Goodies_ReportErrorID': -1,
+            'Goodies_YTWorkers': 4,
+            'Goodies_YTTimeout': 30,
+            'Goodies_YTTimeoutTTL': 60,
+            'Goodies_PlaylistBatch': 25,
+            'Goodies_PlaylistLimit': 500,
+            'Goodies_StatusWindow': 1.0
         })
 
+        workers: int = int(self.client.config['Goodies_YTWorkers'])
+        self.yt_pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ytdl')
+        self.yt_slots = asyncio.Semaphore(workers)
+
     async def post_install(self) -> None:
         self.i18n = self.client.modules['I18n']
         self.ustorage = self.client.modules['UStorage']
+        self.outbound = self.client.modules['Outbound']
+
+    async def shutdown(self) -> None:
+        self.yt_pool.shutdown(wait=False, cancel_futures=True)
+
+        # Final states are delivered without waiting for the window
+        for task in list(self.status_tasks.values()):
+            task.cancel()
+
+        while self.status_pending:
+            key: int = next(iter(self.status_pending))
+            await self.send_status(*self.status_pending.pop(key))
 
     def format_duration(
         self, time: int
@@ -86,15 +186,17 @@ class Module(MetaModule):
         key: str = 'gd_sdata'
     ) -> str:
         # TODO: i18n genre
-        return self.i18n[context][key].format(
-            author=data.author or self.i18n[context]['gd_noauthor'],
-            title=data.title or self.i18n[context]['gd_notitle'],
-            album=data.album or self.i18n[context]['gd_noalbum'],
-            genre=data.genre or self.i18n[context]['gd_nogenre'],
-            year=data.year or self.i18n[context]['gd_noyear'],
+        catalog: Any = self.i18n[context]
+        return catalog.format(
+            key,
+            author=data.author or catalog['gd_noauthor'],
+            title=data.title or catalog['gd_notitle'],
+            album=data.album or catalog['gd_noalbum'],
+            genre=data.genre or catalog['gd_nogenre'],
+            year=data.year or catalog['gd_noyear'],
             url=data.url,
 
-            lyricist=data.lyricist or self.i18n[context]['gd_nolcst'],
+            lyricist=data.lyricist or catalog['gd_nolcst'],
             elapsed=(
                 self.format_duration(elapsed) if elapsed is not None
                 else None
@@ -110,37 +212,381 @@ class Module(MetaModule):
     async def update_status(
         self, context: 'stub.Context', text: str,
         title: Optional[str] = None, **kwargs
-    ) -> Optional[Message]:
+    ) -> None:
+        """Updates the status message of a chat
+
+        Notes
+        -----
+        Updates are coalesced by log chat: the first one is sent
+        right away, and the ones that come in the next
+        `Goodies_StatusWindow` seconds are dropped but the latest,
+        which is sent when the window ends (the same goes for it).
+        They're sent in order, editing the last status message
+        that was sent
+
+        Parameters
+        ----------
+        context
+            The chat context
+        text
+            The status content
+        title
+            The status title (`gd_deftitle` by default)
+        kwargs
+            Extra `edit_message_text`/`send_message` arguments
+        """
+
+        if not context.logging:
+            return
+
         # TODO: Format correctly & check for id separation
-        msgtext: str = self.i18n[context]['gd_container'].format(
-            title=title or self.i18n[context]['gd_deftitle'],
+        catalog: Any = self.i18n[context]
+        msgtext: str = catalog.format(
+            'gd_container',
+            title=title or catalog['gd_deftitle'],
             content='\n'.join([
                 ('╠ ' if x else '║') + x for x in text.split('\n')])
         )
 
+        self.status_pending[context.log_id] = (context, msgtext, kwargs)
+        if context.log_id not in self.status_tasks:
+            self.status_tasks[context.log_id] = asyncio.create_task(
+                self.status_routine(context.log_id))
+
+    async def status_routine(self, log_id: int) -> None:
+        status_id: Optional[int] = None
+        try:
+            while log_id in self.status_pending:
+                context: 'stub.Context'
+                context, text, kwargs = self.status_pending.pop(log_id)
+
+                # The update may have been queued before the status
+                # message was replaced by a previous one
+                if status_id is not None:
+                    context.status_id = status_id
+
+                await self.send_status(context, text, kwargs)
+                status_id = context.status_id
+                await asyncio.sleep(
+                    self.client.config['Goodies_StatusWindow'])
+
+        finally:
+            del self.status_tasks[log_id]
+
+    async def send_status(
+        self, context: 'stub.Context', text: str,
+        kwargs: dict[str, Any]
+    ) -> Optional[Message]:
         out: Optional[Message] = None
-        if context.logging:
+        try:
             try:
-                out = await self.client.edit_message_text(
+                out = await self.outbound.call(
+                    context.log_id, self.outbound.Priority.STATUS,
+                    self.client.edit_message_text,
                     chat_id=context.log_id,
                     message_id=context.status_id,
-                    text=msgtext, **kwargs
+                    text=text, **kwargs
                 )
 
             except MessageIdInvalid:
-                out = await self.client.send_message(
+                out = await self.outbound.call(
+                    context.log_id, self.outbound.Priority.STATUS,
+                    self.client.send_message,
                     chat_id=context.log_id,
-                    text=msgtext, **kwargs
+                    text=text, **kwargs
                 )
 
+                # The handler that made the update saves it, unless
+                # it already did (the context isn't created if it
+                # was deleted in the meantime)
                 context.status_id = out.id
+                stored: Optional['stub.Context'] = \
+                    await self.ustorage.ctx_get_by_voice(context.voice_id)
+                if stored is not None:
+                    stored.status_id = out.id
+                    await self.ustorage.ctx_upd(stored, existing=True)
 
             except MessageNotModified:
                 return None
 
+        except Exception:
+            logging.exception(
+                'Can\'t update the status of `%d`', context.log_id)
+
         return out
 
+    async def extract_info(
+        self, url: str,
+        kind: str = 'info',
+        **kwargs
+    ) -> Any:
+        """Runs yt-dlp `extract_info` on the worker pool
+
+        Notes
+        -----
+        At most `Goodies_YTWorkers` extractions run at the same
+        time, and callers stop waiting for them after they run for
+        `Goodies_YTTimeout` seconds (nothing is cancelled: worker
+        threads can't be interrupted, so the extraction keeps its
+        worker slot until it ends)
+
+        Parameters
+        ----------
+        url
+            The URL to extract the information from
+        kind
+            `info` for metadata extraction, `media` for resolving
+            the media URL of the best audio format
+        kwargs
+            Extra `YoutubeDL.extract_info` arguments
+
+        Returns
+        -------
+        Any
+            The `extract_info` output
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the extraction takes too long
+        """
+
+        return await self.run_ytdl(ytdl_extract, kind, url, kwargs)
+
+    async def run_ytdl(self, func: Callable[..., Any], *args) -> Any:
+        await self.yt_slots.acquire()
+        try:
+            future: asyncio.Future = \
+                asyncio.get_running_loop().run_in_executor(
+                    self.yt_pool, func, *args)
+
+        except BaseException:
+            self.yt_slots.release()
+            raise
+
+        def done(future: asyncio.Future) -> None:
+            # Timed out jobs keep their slot until the worker ends,
+            # so there are never more jobs than workers (and the
+            # timeout only runs while the job does)
+            self.yt_slots.release()
+            if not future.cancelled():
+                future.exception()
+
+        future.add_done_callback(done)
+        return await asyncio.wait_for(
+            asyncio.shield(future),
+            self.client.config['Goodies_YTTimeout'])
+
+    def media_key(self, url: str) -> str:
+        """Gets the canonical key of a media URL
+
+        Returns
+        -------
+        str
+            `youtube:<video id>` for YouTube URLs, and the
+            normalized URL for any other
+        """
+
+        match: Optional[re.Match] = youtube_regex.match(url)
+        if match:
+            return 'youtube:' + match.group(1)
+
+        parts = urlsplit(url.strip())
+        return urlunsplit((
+            parts.scheme.lower(), parts.netloc.lower(),
+            parts.path or '/', parts.query, ''))
+
     async def song_from_url(self, url: str) -> 'stub.SongData':
+        """Fetches the metadata of a track
+
+        Notes
+        -----
+        YouTube lookups are cached by their video ID (see
+        `UStorage.tc_get`), including the failed ones (the ones
+        that time out for `Goodies_YTTimeoutTTL` seconds, as they
+        may be transient)
+
+        Raises
+        ------
+        MetadataUnavailable
+            If the metadata can't be fetched
+        """
+
+        if not youtube_regex.match(url):
+            return await self.fetch_song(url)
+
+        key: str = self.media_key(url)
+        cached: bool
+        data: Optional['stub.SongData']
+
+        cached, data = await self.ustorage.tc_get(key)
+        if cached:
+            if data is None:
+                raise MetadataUnavailable(url)
+            return data
+
+        try:
+            data = await self.fetch_song(url)
+
+        except DownloadError as e:
+            await self.ustorage.tc_put(key, None)
+            raise MetadataUnavailable(url) from e
+
+        except asyncio.TimeoutError as e:
+            await self.ustorage.tc_put(
+                key, None, self.client.config['Goodies_YTTimeoutTTL'])
+            raise MetadataUnavailable(url) from e
+
+        await self.ustorage.tc_put(key, data)
+        return data
+
+    async def songs_from_url(
+        self, url: str
+    ) -> AsyncIterator['stub.SongData']:
+        """Fetches the metadata of every track of a URL
+
+        Notes
+        -----
+        YouTube playlist (and mix) URLs are expanded lazily: their
+        entries are pulled from yt-dlp in batches of
+        `Goodies_PlaylistBatch` (up to `Goodies_PlaylistLimit`)
+        as they're consumed, with the flat metadata of the
+        playlist page. Any other URL yields a single track.
+
+        Playlist URLs of a video (`watch?v=...&list=...`) start at
+        that video, and go on with the entries that follow it.
+
+        Raises
+        ------
+        MetadataUnavailable
+            If the metadata can't be fetched (only before the
+            first track is yielded)
+        """
+
+        entries: Optional[Iterator[dict[str, Any]]] = None
+        data: Optional['stub.SongData']
+
+        # The linked video is fetched on its own (without the list
+        # parameter, that would make yt-dlp expand the playlist)
+        video: Optional[re.Match] = youtube_regex.match(url)
+        if playlist_regex.match(url):
+            if video:
+                watch: str = \
+                    'https://www.youtube.com/watch?v=' + video.group(1)
+                data = await self.song_from_url(watch)
+                data.url = watch
+                yield data
+
+            try:
+                entries = await self.run_ytdl(ytdl_playlist, url)
+
+            except (DownloadError, asyncio.TimeoutError) as e:
+                # The linked video is played anyways
+                if not video:
+                    raise MetadataUnavailable(url) from e
+
+                logging.warning(
+                    'Playlist of `%s` can\'t be expanded: %s', url, e)
+
+            if video and entries is None:
+                return
+
+        if entries is None:
+            data = await self.song_from_url(url)
+            data.url = url
+            yield data
+            return
+
+        limit: int = int(self.client.config['Goodies_PlaylistLimit'])
+        size: int = int(self.client.config['Goodies_PlaylistBatch'])
+        count: int = 0
+
+        # Entries up to the linked video are skipped (and yielded
+        # at the end if it isn't on the playlist)
+        skipped: Optional[list[dict[str, Any]]] = None
+        if video:
+            count += 1
+            skipped = []
+
+        while count + len(skipped or ()) < limit:
+            batch: list[dict[str, Any]]
+            try:
+                batch = await self.run_ytdl(
+                    ytdl_take, entries,
+                    min(size, limit - count - len(skipped or ())))
+
+            except (DownloadError, asyncio.TimeoutError) as e:
+                if not count:
+                    raise MetadataUnavailable(url) from e
+
+                logging.warning(
+                    'Playlist `%s` expansion stopped after %d '
+                    'tracks: %s', url, count, e)
+                break
+
+            if not batch:
+                break
+
+            for entry in batch:
+                if skipped is not None:
+                    if entry.get('id') == video.group(1):
+                        skipped = None
+
+                    else:
+                        skipped.append(entry)
+                    continue
+
+                data = self.song_from_entry(entry)
+                if data is not None:
+                    count += 1
+                    yield data
+
+        for entry in skipped or ():
+            data = self.song_from_entry(entry)
+            if data is not None:
+                count += 1
+                yield data
+
+        if not count:
+            raise MetadataUnavailable(url)
+
+    def song_from_entry(
+        self, entry: dict[str, Any]
+    ) -> Optional['stub.SongData']:
+        # Flat entries of nested playlists/channels are skipped
+        if not entry.get('id') or \
+                entry.get('ie_key', 'Youtube') != 'Youtube':
+            return None
+
+        author: str
+        title: str
+        author, title = self.parse_name(
+            entry.get('channel') or entry.get('uploader') or '',
+            entry.get('title') or '')
+
+        return self.ustorage.SongData(
+            author=author,
+            title=title,
+            album='',
+            genre='',
+            year=0,
+            lyricist='',
+            duration=int(entry.get('duration') or 0),
+            url=f'https://youtube.com/watch?v={entry["id"]}'
+        )
+
+    def parse_name(self, author: str, title: str) -> tuple[str, str]:
+        """Splits `Author - Title` YouTube titles (if they start by
+        the uploader name, and `Goodies_YTParseName` is enabled)"""
+
+        if self.client.config['Goodies_YTParseName']:
+            if title.lower().startswith(author.lower()):
+                if ' - ' in title:
+                    sp = title.split(' - ', 1)
+                    return (sp[0], sp[1])
+        return (author, title)
+
+    async def fetch_song(self, url: str) -> 'stub.SongData':
         duration: int = 0
         year: int = 0
 
@@ -152,8 +598,7 @@ class Module(MetaModule):
         nurl: str = ''
 
         if youtube_regex.match(url):
-            info = ytdl.extract_info(url,
-                download=False, process=False)
+            info = await self.extract_info(url, process=False)
 
             if info['extractor'] != 'youtube':
                 url = info['webpage_url']
@@ -167,8 +612,7 @@ class Module(MetaModule):
                     break
 
                 url = f'https://youtube.com/watch?v={watchv}'
-                info = ytdl.extract_info(url,
-                    download=False, process=False)
+                info = await self.extract_info(url, process=False)
 
             if info['extractor'] == 'youtube':
                 author = info['uploader']
@@ -177,12 +621,7 @@ class Module(MetaModule):
 
                 title = info['title']
                 duration = info['duration']
-                if self.client.config['Goodies_YTParseName']:
-                    if title.lower().startswith(author.lower()):
-                        if ' - ' in title:
-                            sp = title.split(' - ', 1)
-                            author = sp[0]
-                            title = sp[1]
+                author, title = self.parse_name(author, title)
 
                 year = datetime.fromtimestamp(info['timestamp']).year
                 nurl = info['webpage_url']
@@ -198,6 +637,29 @@ class Module(MetaModule):
             url=nurl or url
         )
 
+    async def resolve_media(self, url: str) -> str:
+        """Resolves the media URL of a song (the one that is going
+        to be streamed)
+
+        Parameters
+        ----------
+        url
+            The song URL
+
+        Returns
+        -------
+        str
+            The direct media URL (or the same URL, if it's
+            already a direct one)
+        """
+
+        if not youtube_regex.match(url):
+            return url
+
+        info: dict[str, Any] = await self.extract_info(url, 'media')
+
+        return info.get('url') or url
+
     async def report_error(
         self, context: 'stub.Context', exc: Exception,
         trace: str, method: str
@@ -210,7 +672,9 @@ class Module(MetaModule):
             print(trace)
             return
 
-        await self.client.send_message(
+        await self.outbound.call(
+            rid, self.outbound.Priority.MESSAGE,
+            self.client.send_message,
             chat_id=rid,
             text=self.i18n[context]['gd_report'].format(
                 method=method,
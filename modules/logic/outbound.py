@@ -0,0 +1,284 @@
+"""
+    Outbound Telegram Requests Scheduler
+"""
+
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Optional, Any
+from enum import IntEnum
+import logging
+import asyncio
+import heapq
+import time
+
+from pyrogram.errors import FloodWait
+
+from stub import MetaClient, MetaModule
+
+
+class Priority(IntEnum):
+    """Request classes, the lower ones are sent first"""
+
+    ANSWER = 0
+    MESSAGE = 1
+    STATUS = 2
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second, with bursts of up
+    to `burst` requests
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.stamp: float = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready_at(self, now: float) -> float:
+        """Time at which a token will be available"""
+
+        self.refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def full(self) -> bool:
+        return self.tokens >= self.burst
+
+
+@dataclass(order=True)
+class Request:
+    priority: int
+    seq: int
+    func: Callable[..., Awaitable[Any]] = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict[str, Any] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class ChatQueue:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket: TokenBucket = bucket
+        self.requests: list[Request] = []
+        self.blocked: float = 0
+
+    def ready_at(self, now: float) -> float:
+        return max(self.blocked, self.bucket.ready_at(now))
+
+
+class Module(MetaModule):
+    """
+    Outbound Module
+
+    Every outgoing Telegram request is scheduled through `call`,
+    which enforces a global and a per chat token bucket, sends
+    the requests by priority (see `Priority`) and backs off the
+    chats that get a FloodWait, without stalling the other ones.
+
+    The client `sleep_threshold` is left as is (it's global to
+    every request, scheduled or not), so short FloodWaits are
+    still slept by Pyrogram, inside of the request that got them.
+    """
+
+    def __init__(self, client: MetaClient):
+        self.identifier: str = 'Outbound'
+        self.client: MetaClient = client
+
+        self.Priority = Priority
+
+        # None is used for the requests that aren't chat bound
+        # (e.g. callback query answers)
+        self.chats: dict[Optional[int], ChatQueue] = {}
+        self.glob: Optional[TokenBucket] = None
+        self.seq: int = 0
+
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.inflight: set[asyncio.Task] = set()
+
+    async def setup(self) -> None:
+        pass
+
+    async def install(self) -> None:
+        self.client.register_configuration(self, {
+            'Outbound_GlobalRate': 25,
+            'Outbound_GlobalBurst': 30,
+            'Outbound_ChatRate': 1 / 3,
+            'Outbound_ChatBurst': 5,
+            'Outbound_Retries': 3
+        })
+
+        self.glob = TokenBucket(
+            float(self.client.config['Outbound_GlobalRate']),
+            float(self.client.config['Outbound_GlobalBurst']))
+
+    async def post_install(self) -> None:
+        self.dispatcher = asyncio.create_task(self.dispatch_routine())
+
+    async def shutdown(self) -> None:
+        if self.dispatcher:
+            self.dispatcher.cancel()
+
+        for queue in self.chats.values():
+            for request in queue.requests:
+                request.future.cancel()
+        self.chats.clear()
+
+    async def call(
+        self, chat_id: Optional[int], priority: Priority,
+        func: Callable[..., Awaitable[Any]],
+        *args, **kwargs
+    ) -> Any:
+        """Schedules an outgoing request
+
+        Parameters
+        ----------
+        chat_id
+            The chat the request is sent to (None, if it isn't
+            bound to any chat rate limit)
+        priority
+            The request class
+        func
+            The Pyrogram method (or any coroutine function)
+        args, kwargs
+            The `func` arguments
+
+        Returns
+        -------
+        Any
+            The `func` result
+
+        Raises
+        ------
+        FloodWait
+            If the request got more than `Outbound_Retries`
+            FloodWaits
+        """
+
+        queue: Optional[ChatQueue] = self.chats.get(chat_id)
+        if queue is None:
+            queue = self.chats[chat_id] = ChatQueue(TokenBucket(
+                float(self.client.config['Outbound_ChatRate']),
+                float(self.client.config['Outbound_ChatBurst'])))
+
+        self.seq += 1
+        request: Request = Request(
+            int(priority), self.seq, func, args, kwargs,
+            asyncio.get_running_loop().create_future())
+
+        heapq.heappush(queue.requests, request)
+        self.wakeup.set()
+        return await request.future
+
+    def next_request(
+        self, now: float
+    ) -> tuple[Optional[tuple[Optional[int], ChatQueue]], float]:
+        best: Optional[tuple[Optional[int], ChatQueue]] = None
+        wake: float = float('inf')
+
+        for chat_id, queue in list(self.chats.items()):
+            if not queue.requests:
+                # Idle chats are forgotten once they're fully refilled
+                queue.bucket.refill(now)
+                if queue.blocked <= now and queue.bucket.full():
+                    del self.chats[chat_id]
+                continue
+
+            ready: float = queue.blocked if chat_id is None \
+                else queue.ready_at(now)
+            if ready > now:
+                wake = min(wake, ready)
+
+            elif best is None or queue.requests[0] < best[1].requests[0]:
+                best = (chat_id, queue)
+
+        return (best, wake)
+
+    async def dispatch_routine(self) -> None:
+        while True:
+            self.wakeup.clear()
+            now: float = time.monotonic()
+
+            best: Optional[tuple[Optional[int], ChatQueue]]
+            wake: float
+            best, wake = self.next_request(now)
+
+            if best is not None:
+                wake = self.glob.ready_at(now)
+                if wake <= now:
+                    chat_id, queue = best
+                    request: Request = heapq.heappop(queue.requests)
+                    self.glob.take()
+                    if chat_id is not None:
+                        queue.bucket.take()
+
+                    task: asyncio.Task = asyncio.create_task(
+                        self.run(chat_id, request))
+                    self.inflight.add(task)
+                    task.add_done_callback(self.inflight.discard)
+                    continue
+
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(),
+                    None if wake == float('inf') else wake - now)
+
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, chat_id: Optional[int], request: Request) -> None:
+        if request.future.cancelled():
+            return
+
+        try:
+            result: Any = await request.func(*request.args, **request.kwargs)
+            if not request.future.done():
+                request.future.set_result(result)
+
+        except FloodWait as e:
+            request.attempts += 1
+            if request.attempts > self.client.config['Outbound_Retries']:
+                if not request.future.done():
+                    request.future.set_exception(e)
+                return
+
+            logging.warning(
+                'FloodWait of %ss on `%s`, backing off', e.value, chat_id)
+
+            queue: Optional[ChatQueue] = self.chats.get(chat_id)
+            if queue is None:
+                queue = self.chats[chat_id] = ChatQueue(TokenBucket(
+                    float(self.client.config['Outbound_ChatRate']),
+                    float(self.client.config['Outbound_ChatBurst'])))
+
+            queue.blocked = time.monotonic() + float(e.value)
+            heapq.heappush(queue.requests, request)
+            self.wakeup.set()
+
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+
+
+    def stub(self, root: dict[str, Any]) -> None:
+        root['outbound'] = {
+            '__name__': 'Outbound',
+            'call': Callable[..., Any],
+            'Priority': {
+                '__name__': 'Priority',
+                'ANSWER': int,
+                'MESSAGE': int,
+                'STATUS': int
+            }
+        }
@@ -3,9 +3,13 @@
 """
 
 from collections.abc import AsyncGenerator, Callable
+from collections import deque
 from typing import Optional, Any
 from enum import Enum, auto
 import traceback
+import logging
+import asyncio
+import time
 
 from pyrogram.errors.exceptions.bad_request_400 import (
     ChannelInvalid,
@@ -48,31 +52,169 @@ class PlayerStatus(Enum):
 
 
 class Module(MetaModule):
+    """
+    Player Module
+
+    Besides playing, it looks ahead at the next song of every
+    playlist (`Player_PrefetchLead` seconds before the current
+    one ends) and pre-resolves its media URL, so `next` can
+    switch tracks with a minimal gap (which is measured, see
+    `gap_stats`).
+
+    Playlist URLs are enqueued in the background as they're
+    expanded (see `enqueue_stream`).
+    """
+
     ustorage: MetaClient
+    outbound: MetaClient
     goodies: MetaClient
     i18n: MetaClient
 
     def __init__(self, client: MetaClient):
         self.identifier: str = 'Player'
+        self.requires: tuple[str, ...] = (
+            'I18n', 'Goodies', 'UStorage', 'Outbound')
         self.client: MetaClient = client
         self.userbot: Client = self.client.userbot
 
         self.player_status = PlayerStatus
         self.api: PyTgCalls = self.client.api
 
+        # voice_id -> (playlist id, resolved media URL)
+        self.prefetched: dict[int, tuple[int, str]] = {}
+        self.lookahead: dict[int, asyncio.Task] = {}
+        self.durations: dict[int, int] = {}
+        self.expanding: dict[int, list[asyncio.Task]] = {}
+
+        self.ended: dict[int, float] = {}
+        self.gaps: deque[float] = deque(maxlen=256)
+
     async def setup(self) -> None:
         pass
 
     async def install(self) -> None:
         self.client.register_configuration(self, {
-            'Player_InviteLink': 'RadioBot'
+            'Player_InviteLink': 'RadioBot',
+            'Player_PrefetchLead': 20,
+            'Player_EnqueueBatch': 25
         })
 
     async def post_install(self) -> None:
         self.i18n = self.client.modules['I18n']
         self.goodies = self.client.modules['Goodies']
         self.ustorage = self.client.modules['UStorage']
+        self.outbound = self.client.modules['Outbound']
+
+
+    def prefetch(
+        self, voice_id: int,
+        duration: Optional[int] = None
+    ) -> None:
+        """Schedules the look ahead of the next song of a playlist
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        duration
+            The duration of the song that is being played (by
+            default, the last known one)
+        """
+
+        if duration is not None:
+            self.durations[voice_id] = duration
+
+        task: Optional[asyncio.Task] = self.lookahead.get(voice_id)
+        if task and not task.done():
+            task.cancel()
+
+        self.prefetched.pop(voice_id, None)
+        self.lookahead[voice_id] = asyncio.create_task(
+            self.lookahead_routine(voice_id))
+
+    def ensure_prefetch(self, voice_id: int) -> None:
+        # The playlist may have been empty when it looked ahead
+        if voice_id not in self.prefetched:
+            task: Optional[asyncio.Task] = self.lookahead.get(voice_id)
+            if not task or task.done():
+                self.prefetch(voice_id)
+
+    async def forget(self, voice_id: int) -> None:
+        tasks: list[asyncio.Task] = self.expanding.pop(voice_id, [])
+        lookahead: Optional[asyncio.Task] = self.lookahead.pop(voice_id, None)
+        if lookahead:
+            tasks.append(lookahead)
+
+        for task in tasks:
+            task.cancel()
+
+        # Their unfenced writes must be over before the playlist
+        # is cleaned, or they'd outlive it
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.prefetched.pop(voice_id, None)
+        self.durations.pop(voice_id, None)
+        self.ended.pop(voice_id, None)
+
+    async def lookahead_routine(self, voice_id: int) -> None:
+        duration: int = self.durations.get(voice_id, 0)
+        lead: float = self.client.config['Player_PrefetchLead']
+
+        try:
+            if duration:
+                elapsed: int = 0
+                try:
+                    elapsed = await self.api.played_time(voice_id)
+
+                except Exception:
+                    pass
+
+                await asyncio.sleep(max(0, duration - elapsed - lead))
+
+            position: Optional[int] = await self.ustorage.pl_position(
+                voice_id)
+            if position is None:
+                return
+
+            data: list['stub.SongData'] = await self.ustorage.pl_fetch(
+                voice_id, limit=1, offset=position)
+            if not data:
+                return
+
+            self.prefetched[voice_id] = (
+                position, await self.goodies.resolve_media(data[0].url))
+
+        except asyncio.CancelledError:
+            raise
 
+        except Exception:
+            logging.exception(
+                'Can\'t look ahead the next song of `%d`', voice_id)
+
+    def stream_ended(self, voice_id: int) -> None:
+        """Marks the end of the current stream (for measuring the gap
+        between it and the next one)"""
+
+        self.ended[voice_id] = time.monotonic()
+
+    def gap_stats(self) -> dict[str, float]:
+        """Gap between tracks stats (of the last 256 track changes)
+
+        Returns
+        -------
+        dict
+            `count`, `last`, `avg` & `max` gaps (in ms)
+        """
+
+        if not self.gaps:
+            return {'count': 0, 'last': 0, 'avg': 0, 'max': 0}
+
+        return {
+            'count': len(self.gaps),
+            'last': self.gaps[-1] * 1000,
+            'avg': sum(self.gaps) / len(self.gaps) * 1000,
+            'max': max(self.gaps) * 1000
+        }
 
     async def play(
         self, context: 'stub.Context',
@@ -81,6 +223,8 @@ class Module(MetaModule):
         if context.voice_id in (await self.api.calls):
             await self.ustorage.pl_enqueue(
                 context.voice_id, data)
+            self.ensure_prefetch(context.voice_id)
+
             yield PlayerStatus.ENQUEUED
             return
 
@@ -92,7 +236,9 @@ class Module(MetaModule):
 
             link: ChatInviteLink
             try:
-                link = await self.client.create_chat_invite_link(
+                link = await self.outbound.call(
+                    context.voice_id, self.outbound.Priority.MESSAGE,
+                    self.client.create_chat_invite_link,
                     context.voice_id, member_limit=1,
                     name=self.client.config['Player_InviteLink'])
 
@@ -133,13 +279,89 @@ class Module(MetaModule):
         # Just 4 logging (& saving the first element of the playlist)
         await self.ustorage.pl_enqueue(context.voice_id, data)
         await self.ustorage.pl_dequeue(context.voice_id)
+        self.prefetch(context.voice_id, data.duration)
 
         yield PlayerStatus.OK
 
+    def enqueue_stream(
+        self, context: 'stub.Context',
+        songs: AsyncGenerator['stub.SongData', None]
+    ) -> None:
+        """Enqueues the songs of a stream in the background, in
+        batches of `Player_EnqueueBatch` (it's cancelled if the
+        player stops)
+
+        Parameters
+        ----------
+        context
+            The chat context
+        songs
+            The songs to be enqueued (e.g. the rest of the ones
+            of `Goodies.songs_from_url`)
+        """
+
+        # Streams are enqueued one after the other
+        tasks: list[asyncio.Task] = self.expanding.setdefault(
+            context.voice_id, [])
+        tasks.append(asyncio.create_task(self.enqueue_routine(
+            context.voice_id, songs, tasks[-1] if tasks else None)))
+
+    async def enqueue_routine(
+        self, voice_id: int,
+        songs: AsyncGenerator['stub.SongData', None],
+        previous: Optional[asyncio.Task] = None
+    ) -> None:
+        size: int = int(self.client.config['Player_EnqueueBatch'])
+        batch: list['stub.SongData'] = []
+        count: int = 0
+
+        # These writes aren't fenced (see `UStorage.fenced`): they
+        # outlive the lock of the handler that started them, only
+        # append to the playlist, and are cancelled (and awaited)
+        # by `forget` before the player cleans it up
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+
+            async for song in songs:
+                batch.append(song)
+                if len(batch) < size:
+                    continue
+
+                await self.ustorage.pl_enqueue_many(voice_id, batch)
+                self.ensure_prefetch(voice_id)
+                count += len(batch)
+                batch = []
+
+            if batch:
+                await self.ustorage.pl_enqueue_many(voice_id, batch)
+                self.ensure_prefetch(voice_id)
+                count += len(batch)
+
+            if count:
+                logging.info(
+                    'Enqueued %d streamed songs on `%d`', count, voice_id)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            logging.exception(
+                'Can\'t enqueue the streamed songs of `%d`', voice_id)
+
+        finally:
+            await songs.aclose()
+            tasks: list[asyncio.Task] = self.expanding.get(voice_id, [])
+            if asyncio.current_task() in tasks:
+                tasks.remove(asyncio.current_task())
+            if not tasks:
+                self.expanding.pop(voice_id, None)
+
     async def stop(
         self, context: 'stub.Context',
         leave: bool = True
     ) -> None:
+        await self.forget(context.voice_id)
         await self.ustorage.pl_clean(context.voice_id)
         if leave:
             try:
@@ -165,7 +387,7 @@ class Module(MetaModule):
             await self.ustorage.pl_dequeue(context.voice_id)
 
         if not next_data:
-            await self.ustorage.pl_clean(context.voice_id)
+            # `stop` cleans the playlist once the expansions are over
             try:
                 await self.stop(context)
 
@@ -174,9 +396,16 @@ class Module(MetaModule):
 
             return PlayerStatus.ENDED
 
+        url: str = next_data[1].url
+        prefetched: Optional[tuple[int, str]] = \
+            self.prefetched.pop(context.voice_id, None)
+
+        if prefetched and prefetched[0] == next_data[0]:
+            url = prefetched[1]
+
         try:
             await self.api.play(context.voice_id, MediaStream(
-                next_data[1].url, video_flags=MediaStream.Flags.IGNORE,
+                url, video_flags=MediaStream.Flags.IGNORE,
                 audio_flags=MediaStream.Flags.REQUIRED))
 
         except ChatAdminRequired:
@@ -191,6 +420,16 @@ class Module(MetaModule):
                 'player_next[play]')
 
             return PlayerStatus.UNKNOWN_ERROR
+
+        ended: Optional[float] = self.ended.pop(context.voice_id, None)
+        if ended is not None:
+            gap: float = time.monotonic() - ended
+            self.gaps.append(gap)
+            logging.info(
+                'Gap between tracks on `%d`: %fms (prefetched: %s)',
+                context.voice_id, gap * 1000, url != next_data[1].url)
+
+        self.prefetch(context.voice_id, next_data[1].duration)
         return PlayerStatus.OK
 
 
@@ -203,6 +442,10 @@ class Module(MetaModule):
             'resume': Callable[['stub.Context'], None],
             'next': Callable[['stub.Context'], 'PlayerStatus'],
             'status': Callable[['stub.Context'], 'PlayerStatus'],
+            'prefetch': Callable[[int, Optional[int]], None],
+            'enqueue_stream': Callable[['stub.Context', Any], None],
+            'stream_ended': Callable[[int], None],
+            'gap_stats': Callable[[], dict[str, float]],
 
             'PlayerStatus': {
                 '__name__': 'PlayerStatus',
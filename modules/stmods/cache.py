@@ -0,0 +1,128 @@
+"""
+    In-memory cache helpers for UStorage
+"""
+
+from collections.abc import Callable, Hashable
+from collections import OrderedDict
+from typing import Any, Optional
+import time
+
+
+class LRUCache:
+    """
+    Bounded Least-Recently-Used cache with per-entry TTL
+
+    Entries are evicted when the cache grows bigger than
+    `size`, or lazily when they are found to be expired.
+    It keeps hit/miss/eviction counters, so the effectiveness
+    of the cache can be checked at runtime (see `stats`).
+    """
+
+    def __init__(
+        self, size: int, ttl: float,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        """
+        Parameters
+        ----------
+        size
+            Max amount of entries to hold (0 disables the cache)
+        ttl
+            Seconds for an entry to expire (0 disables expiration)
+        on_evict
+            Called with (key, value) every time an entry leaves
+            the cache for any reason other than `clear`
+        """
+
+        self.size: int = size
+        self.ttl: float = ttl
+        self.on_evict: Optional[Callable[[Hashable, Any], None]] = on_evict
+
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def _drop(self, key: Hashable) -> Any:
+        value: Any = self.entries.pop(key)[1]
+        if self.on_evict:
+            self.on_evict(key, value)
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Gets an entry without updating counters nor recency"""
+
+        entry: Optional[tuple[float, Any]] = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if self.ttl and entry[0] < time.monotonic():
+            self._drop(key)
+            self.evictions += 1
+            return None
+        return entry[1]
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Gets an entry, marking it as the most recently used one
+
+        Returns
+        -------
+        Any | None
+            The cached value, or None if it isn't cached
+            (or it's expired)
+        """
+
+        value: Optional[Any] = self.peek(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Inserts (or replaces) an entry, evicting the LRU one if needed"""
+
+        if self.size <= 0:
+            return
+
+        if key in self.entries:
+            self._drop(key)
+
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        while len(self.entries) > self.size:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Removes an entry (if it exists) and returns it"""
+
+        if key not in self.entries:
+            return None
+        return self._drop(key)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Cache counters
+
+        Returns
+        -------
+        dict
+            `size`, `hits`, `misses` & `evictions` of the cache
+        """
+
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
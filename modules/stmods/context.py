@@ -1,14 +1,18 @@
 from collections.abc import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from typing import Optional, Any
+import logging
+import asyncio
 
 from pyrogram.types import Message, CallbackQuery, Update
 from pyrogram import Client
 
+from asyncpg.prepared_stmt import PreparedStatement
 from asyncpg.connection import Connection
 from asyncpg import Record
 
 from stub import MetaClient, MetaModule
+from modules.stmods.cache import LRUCache
 
 
 @dataclass
@@ -35,6 +39,14 @@ class Context:
     status_id
         The last update message ID, it may be used for not to
         repeat many messages on the Chat
+    catalog
+        The i18n catalog of `lang_code`, bound by `I18n` on its
+        first lookup (it isn't persisted, and it must be reset if
+        `lang_code` changes)
+    _snapshot
+        The persisted values of the fields above (as they were
+        when the object was loaded from/saved on the DB), used for
+        tracking modifications (see `dirty_fields`)
     """
 
     voice_id: int = 0
@@ -43,11 +55,74 @@ class Context:
     lang_code: str = 'en'
     status_id: int = -1
 
+    catalog: Optional[Any] = field(
+        default=None, compare=False, repr=False)
+    _snapshot: Optional[tuple[int, int, bool, str, int]] = field(
+        default=None, compare=False, repr=False)
+
+    def values(self) -> tuple[int, int, bool, str, int]:
+        return (
+            self.voice_id, self.log_id, self.logging,
+            self.lang_code, self.status_id
+        )
+
+    def mark_clean(self) -> None:
+        """Marks the current state as the persisted one"""
+
+        self._snapshot = self.values()
+
+    def dirty_fields(self) -> tuple[str, ...]:
+        """Fields modified since the last load/save
+
+        Returns
+        -------
+        tuple
+            The modified fields names (every field if the
+            `Context` was never persisted)
+        """
+
+        if self._snapshot is None:
+            return ContextFields
+
+        return tuple(
+            name for name, old, new in zip(
+                ContextFields, self._snapshot, self.values())
+            if old != new
+        )
+
+    @property
+    def dirty(self) -> bool:
+        return self._snapshot != self.values()
+
 ContextTuple = tuple[int, bool, str, int]
+ContextFields = ('voice_id', 'log_id', 'logging', 'lang_code', 'status_id')
 
 
 class Module(MetaModule):
+    """
+    Context API Module
+
+    Stores the `Context` of every chat on the DB. Lookups are
+    served from a bounded write-through LRU cache first (sized
+    with `CtxSt_CacheSize` & `CtxSt_CacheTTL`), so most of the
+    handler invocations don't need any DB round trip for it.
+
+    Updates can optionally be written behind (`CtxSt_WriteBehind`):
+    they are coalesced per voice_id and flushed in batches every
+    `CtxSt_FlushInterval` ms, or as soon as `CtxSt_FlushSize`
+    contexts are pending.
+    """
+
     i18n: MetaModule
+    cache: LRUCache
+    logids: dict[int, int]
+
+    pending: dict[int, Context]
+    pending_logids: dict[int, set[int]]
+    deletes: int = 0
+    flush_lock: asyncio.Lock
+    flush_event: asyncio.Event
+    flush_task: Optional[asyncio.Task] = None
 
     query_new: str = '''
         INSERT INTO Telegram.Context VALUES($1, $2)
@@ -55,6 +130,12 @@ class Module(MetaModule):
             SET context = excluded.context;
     '''
 
+    query_upd: str = '''
+        UPDATE Telegram.Context SET context = $2
+        WHERE voice_id = $1
+        RETURNING voice_id
+    '''
+
     query_byvoice: str = '''
         SELECT context::Telegram.ContextObj FROM Telegram.Context
         WHERE voice_id = $1
@@ -63,11 +144,28 @@ class Module(MetaModule):
     query_bylogid: str = '''
         SELECT voice_id, context::Telegram.ContextObj FROM Telegram.Context
         WHERE (context).log_id = $1
+        ORDER BY voice_id
+        LIMIT 1
     '''
 
+    # Two index probes (`voice_id` unique index first, then the
+    # `(context).log_id` expression index), instead of an `OR` that
+    # can't use any of them
     query_byaid: str = '''
-        SELECT voice_id, context::Telegram.ContextObj FROM Telegram.Context
-        WHERE (context).log_id = $1 OR voice_id = $1
+        SELECT voice_id, context::Telegram.ContextObj, priority FROM (
+            (
+                SELECT voice_id, context, 0 AS priority
+                FROM Telegram.Context
+                WHERE voice_id = $1
+            ) UNION ALL (
+                SELECT voice_id, context, 1 AS priority
+                FROM Telegram.Context
+                WHERE (context).log_id = $1
+                ORDER BY voice_id
+                LIMIT 1
+            )
+        ) AS found
+        ORDER BY priority
         LIMIT 1
     '''
 
@@ -84,7 +182,7 @@ class Module(MetaModule):
         self.context: Context = Context
 
     async def setup(self):
-        async with self.db.pool.acquire() as conn:
+        async with self.db.connection() as conn:
             async with conn.transaction():
                 await conn.execute('''
                     DROP SCHEMA IF EXISTS Telegram CASCADE;
@@ -104,9 +202,31 @@ class Module(MetaModule):
                         voice_id bigint unique,
                         context Telegram.ContextObj
                     );
+                    CREATE INDEX Context_LogID
+                        ON Telegram.Context (((context).log_id));
                 ''')
 
     async def install(self):
+        self.client.register_configuration(self, {
+            'CtxSt_CacheSize': 4096,
+            'CtxSt_CacheTTL': 300,
+            'CtxSt_WriteBehind': False,
+            'CtxSt_FlushInterval': 250,
+            'CtxSt_FlushSize': 256
+        })
+
+        self.pending = {}
+        self.pending_logids = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_event = asyncio.Event()
+
+        self.logids = {}
+        self.cache = LRUCache(
+            int(self.client.config['CtxSt_CacheSize']),
+            float(self.client.config['CtxSt_CacheTTL']),
+            on_evict=self.cache_evicted
+        )
+
         self.db.Context = Context
         self.db.c11e = self.c11e
 
@@ -117,15 +237,28 @@ class Module(MetaModule):
         self.db.ctx_get_by_voice = self.ctx_get_by_voice
         self.db.ctx_get_by_logid = self.ctx_get_by_logid
         self.db.ctx_delete_by_voice = self.ctx_delete_by_voice
+        self.db.ctx_cache_stats = self.cache.stats
+        self.db.ctx_flush = self.ctx_flush
 
     async def post_install(self):
         self.i18n = self.client.modules['I18n']
-        async with self.db.pool.acquire() as conn:
+        self.cache.clear()
+        self.logids.clear()
+        async with self.db.connection() as conn:
             async with conn.transaction():
                 await conn.execute('''
                     DELETE FROM Telegram.Context;
                 ''')
 
+        if self.client.config['CtxSt_WriteBehind']:
+            self.flush_task = asyncio.create_task(self.flusher())
+
+    async def shutdown(self) -> None:
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.ctx_flush()
+
     async def db_init(self, conn: Connection) -> None:
         def encoder(data: Context) -> ContextTuple:
             return (
@@ -151,6 +284,128 @@ class Module(MetaModule):
         )
 
 
+    def cache_evicted(self, voice_id: int, context: Context) -> None:
+        if self.logids.get(context.log_id) == voice_id:
+            del self.logids[context.log_id]
+
+    def cache_put(
+        self, context: Context,
+        deletes: Optional[int] = None
+    ) -> None:
+        # Rows read before a delete committed aren't cached
+        if self.cache.size <= 0 or \
+                (deletes is not None and deletes != self.deletes):
+            return
+
+        self.cache.put(context.voice_id, replace(context))
+        self.logids[context.log_id] = context.voice_id
+
+    def cache_get(self, voice_id: Optional[int]) -> Optional[Context]:
+        """Gets a copy of a cached `Context`
+
+        Notes
+        -----
+        Copies are returned so handlers can't modify the cached
+        version without going through `ctx_upd`
+        """
+
+        context: Optional[Context] = self.cache.get(voice_id)
+        if context is not None:
+            return replace(context)
+        return None
+
+    def pending_get(
+        self, aid: int,
+        by_voice: bool = True,
+        by_logid: bool = True
+    ) -> Optional[Context]:
+        """Gets a copy of a `Context` that is waiting to be flushed
+        (by log_id, the one with the lowest voice_id)"""
+
+        context: Optional[Context] = None
+        if by_voice:
+            context = self.pending.get(aid)
+
+        if context is None and by_logid:
+            voices: Optional[set[int]] = self.pending_logids.get(aid)
+            if voices:
+                context = self.pending[min(voices)]
+
+        if context is not None:
+            return replace(context)
+        return None
+
+    def pending_put(self, context: Context) -> None:
+        old: Optional[Context] = self.pending.get(context.voice_id)
+        if old is not None and old.log_id != context.log_id:
+            self.pending_unindex(old)
+
+        self.pending[context.voice_id] = replace(context)
+        self.pending_logids.setdefault(
+            context.log_id, set()).add(context.voice_id)
+
+    def pending_pop(self, voice_id: int) -> Optional[Context]:
+        context: Optional[Context] = self.pending.pop(voice_id, None)
+        if context is not None:
+            self.pending_unindex(context)
+        return context
+
+    def pending_unindex(self, context: Context) -> None:
+        voices: Optional[set[int]] = self.pending_logids.get(context.log_id)
+        if voices is not None:
+            voices.discard(context.voice_id)
+            if not voices:
+                del self.pending_logids[context.log_id]
+
+    async def flusher(self) -> None:
+        interval: float = self.client.config['CtxSt_FlushInterval'] / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), interval)
+
+            except asyncio.TimeoutError:
+                pass
+
+            self.flush_event.clear()
+            try:
+                await self.ctx_flush()
+
+            except Exception:
+                logging.exception('Can\'t flush pending `Context` updates')
+
+    async def ctx_flush(self) -> None:
+        """Writes every pending (written behind) `Context` to the DB
+
+        Notes
+        -----
+        Pending contexts are written in a single batched upsert, if
+        it fails, the ones that weren't updated again in the meantime
+        are queued back
+        """
+
+        async with self.flush_lock:
+            if not self.pending:
+                return
+
+            batch: dict[int, Context] = self.pending
+            self.pending = {}
+            self.pending_logids = {}
+
+            try:
+                async with self.db.connection() as conn:
+                    stmt: PreparedStatement = await conn.prepared(
+                        self, 'query_new')
+                    async with conn.transaction():
+                        await stmt.executemany([
+                            (ctx.voice_id, ctx) for ctx in batch.values()
+                        ])
+
+            except Exception:
+                for voice_id, ctx in batch.items():
+                    if voice_id not in self.pending:
+                        self.pending_put(ctx)
+                raise
+
     def c11e(
         self, method: Callable[[MetaClient, Update], Any],
         auto_update: bool = True, required: bool = False
@@ -177,46 +432,48 @@ class Module(MetaModule):
         async def middle(
             client: MetaClient, update: Message | CallbackQuery
         ) -> Any:
-            if isinstance(update, Message):
-                chat_id: int = update.chat.id
+            # The storage calls made by the handler (context, playlist &
+            # lock ones) share a connection while they run
+            async with self.db.unit_of_work():
+                if isinstance(update, Message):
+                    chat_id: int = update.chat.id
 
-            else:
-                chat_id: int = update.message.chat.id
+                else:
+                    chat_id: int = update.message.chat.id
 
-            context: Optional['Context'] = \
-                await self.db.ctx_get_by_aid(chat_id)
+                context: Optional['Context'] = \
+                    await self.db.ctx_get_by_aid(chat_id)
 
-            if required and not context:
-                return
+                if required and not context:
+                    return
 
-            if not context:
-                lc: str = self.i18n.default
-                if hasattr(update, 'from_user') and \
-                        hasattr(update.from_user, 'language_code'):
-                    lc = update.from_user.language_code
+                if not context:
+                    lc: str = self.i18n.default
+                    if hasattr(update, 'from_user') and \
+                            hasattr(update.from_user, 'language_code'):
+                        lc = update.from_user.language_code or lc
 
-                chat: Optional[int] = None
-                if hasattr(update, 'chat'):
-                    chat = update.chat.id
+                    chat: Optional[int] = None
+                    if hasattr(update, 'chat'):
+                        chat = update.chat.id
 
-                if chat is not None:
-                    context = self.db.Context(
-                        voice_id=chat,
-                        log_id=chat,
-                        logging=True,
-                        lang_code=lc,
-                        status_id=-1
-                    )
+                    if chat is not None:
+                        context = self.db.Context(
+                            voice_id=chat,
+                            log_id=chat,
+                            logging=True,
+                            lang_code=lc,
+                            status_id=-1
+                        )
 
-            output: Any = await method(client, update, context)
-            if auto_update and output is not None:
-                print('delete context from')
-                await self.db.ctx_upd(context)
+                output: Any = await method(client, update, context)
+                if auto_update and output is not None and context is not None:
+                    await self.db.ctx_upd(context)
 
-            elif output is False and context is not None:
-                await self.db.ctx_delete(context)
+                elif output is False and context is not None:
+                    await self.db.ctx_delete(context)
 
-            return output
+                return output
 
         return middle
 
@@ -259,15 +516,31 @@ class Module(MetaModule):
         ))
 
     async def ctx_upd(
-        self, context: Context
+        self, context: Context,
+        force: bool = False,
+        sync: bool = False,
+        existing: bool = False
     ) -> Context:
         """Reflects a previously created context updates on the DB
 
+        Notes
+        -----
+        Nothing is written if the context wasn't modified since
+        it was loaded/saved (see `Context.dirty_fields`)
+
         Parameters
         ----------
         context
             The `Context` object to update, with the
             new information
+        force
+            Write the context even if it isn't modified
+        sync
+            Write the context right away, even if `CtxSt_WriteBehind`
+            is enabled (for code paths that require durability)
+        existing
+            Only update the context if it's still stored (it's
+            never created), written right away
 
         Returns
         -------
@@ -275,12 +548,63 @@ class Module(MetaModule):
             The `Context` object
         """
 
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute(self.query_new,
-                    context.voice_id, context)
+        changed: tuple[str, ...] = context.dirty_fields()
+        if not changed and not force:
+            return context
+
+        # A delete that commits while this is written could be run
+        # before or after it, so the context isn't cached then
+        deletes: int = self.deletes
+
+        # Pending contexts exist, even if they aren't on the DB yet
+        if self.flush_task and not sync and \
+                (not existing or context.voice_id in self.pending):
+            self.pending_put(context)
+            if len(self.pending) >= self.client.config['CtxSt_FlushSize']:
+                self.flush_event.set()
+
+            context.mark_clean()
+            self.cache_put(context, deletes)
+            return context
+
+        if self.flush_task:
+            # A batch that is being written can't overwrite this update
+            async with self.flush_lock:
+                self.pending_pop(context.voice_id)
+                written: bool = await self.ctx_write(
+                    context, changed, existing)
+
+        else:
+            written = await self.ctx_write(context, changed, existing)
+
+        if written:
+            context.mark_clean()
+            self.cache_put(context, deletes)
         return context
 
+    async def ctx_write(
+        self, context: Context,
+        changed: tuple[str, ...],
+        existing: bool = False
+    ) -> bool:
+        async with self.db.connection() as conn:
+            async with conn.transaction():
+                updated: Optional[int] = None
+                if 'voice_id' not in changed:
+                    stmt: PreparedStatement = await conn.prepared(
+                        self, 'query_upd')
+                    updated = await stmt.fetchval(
+                        context.voice_id, context)
+
+                if updated is None:
+                    if existing:
+                        return False
+
+                    stmt: PreparedStatement = await conn.prepared(
+                        self, 'query_new')
+                    await stmt.fetch(context.voice_id, context)
+        return True
+
     async def ctx_get_by_voice(
         self, voice_id: int
     ) -> Optional[Context]:
@@ -297,15 +621,23 @@ class Module(MetaModule):
             The `Context` object, if it exists
         """
 
-        context: Optional[Context] = None
-        async with self.db.pool.acquire() as conn:
-            row: Optional[Record] = await conn.fetchrow(
-                self.query_byvoice, voice_id)
+        context: Optional[Context] = self.cache_get(voice_id) or \
+            self.pending_get(voice_id, by_logid=False)
+        if context is not None:
+            return context
+
+        deletes: int = self.deletes
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_byvoice')
+            row: Optional[Record] = await stmt.fetchrow(voice_id)
 
             if row:
                 ctx: Context = row['context']
                 ctx.voice_id = voice_id
+                ctx.mark_clean()
                 context = ctx
+                self.cache_put(context, deletes)
         return context
 
     async def ctx_get_by_logid(
@@ -324,15 +656,24 @@ class Module(MetaModule):
             The `Context` object, if it exists
         """
 
-        context: Optional[Context] = None
-        async with self.db.pool.acquire() as conn:
-            row: Optional[Record] = await conn.fetchrow(
-                self.query_bylogid, log_id)
+        context: Optional[Context] = self.cache_get(
+            self.logids.get(log_id)) or \
+            self.pending_get(log_id, by_voice=False)
+        if context is not None:
+            return context
+
+        deletes: int = self.deletes
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_bylogid')
+            row: Optional[Record] = await stmt.fetchrow(log_id)
 
             if row:
                 ctx: Context = row['context']
                 ctx.voice_id = row['voice_id']
+                ctx.mark_clean()
                 context = ctx
+                self.cache_put(context, deletes)
         return context
 
     async def ctx_get_by_aid(
@@ -342,8 +683,11 @@ class Module(MetaModule):
 
         Notes
         -----
-        This method is unreliable, it may return a `Context` that
-        isn't the one that was being searched in the first place
+        A `Context` whose voice_id matches has priority over
+        the ones whose log_id matches (and those are ordered
+        by their voice_id), so the lookup is deterministic, but
+        it may still return a `Context` that isn't the one that
+        was being searched in the first place
 
         Parameters
         ----------
@@ -356,33 +700,59 @@ class Module(MetaModule):
             The `Context` object, if it exists
         """
 
-        context: Optional[Context] = None
-        async with self.db.pool.acquire() as conn:
-            row: Optional[Record] = await conn.fetchrow(
-                self.query_byaid, aid)
-
-            if row:
-                ctx: Context = row['context']
-                ctx.voice_id = row['voice_id']
-                context = ctx
+        # Only voice_id matches can skip the DB, a cached log_id
+        # match may not be the one with the lowest voice_id
+        context: Optional[Context] = self.cache_get(aid) or \
+            self.pending_get(aid, by_logid=False)
+        if context is not None:
+            return context
+
+        deletes: int = self.deletes
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_byaid')
+            row: Optional[Record] = await stmt.fetchrow(aid)
+
+        # Written behind contexts aren't on the DB yet
+        pending: Optional[Context] = None
+        if not row or row['priority'] != 0:
+            pending = self.pending_get(aid, by_voice=False)
+
+        if not row or (pending and pending.voice_id < row['voice_id']):
+            return pending
+
+        context = self.cache_get(row['voice_id']) or \
+            self.pending_get(row['voice_id'], by_logid=False)
+        if context is None:
+            context = row['context']
+            context.voice_id = row['voice_id']
+            context.mark_clean()
+            self.cache_put(context, deletes)
         return context
 
     async def ctx_delete(
         self, context: Context
     ) -> None:
         # traceback.print_stack()
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute(
-                    self.query_delete, context.voice_id)
+        await self.ctx_delete_by_voice(context.voice_id)
 
     async def ctx_delete_by_voice(
         self, voice_id: int
     ) -> None:
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute(
-                    self.query_delete, voice_id)
+        # Holding the flush lock, so a batch that is being written
+        # can't bring the deleted context back
+        async with self.flush_lock:
+            self.pending_pop(voice_id)
+            async with self.db.connection() as conn:
+                stmt: PreparedStatement = await conn.prepared(
+                    self, 'query_delete')
+                async with conn.transaction():
+                    await stmt.fetch(voice_id)
+
+            # Once it's committed, so lookups can't cache it again
+            # (the ones that read it before are told by `deletes`)
+            self.deletes += 1
+            self.cache.pop(voice_id)
 
 
     def stub(self, root: dict[str, Any]) -> None:
@@ -393,7 +763,11 @@ class Module(MetaModule):
                 'log_id': int,
                 'logging': bool,
                 'lang_code': str,
-                'status_id': int
+                'status_id': int,
+                'catalog': Any,
+                'dirty': bool,
+                'mark_clean': Callable[[], None],
+                'dirty_fields': Callable[[], tuple[str, ...]]
             },
 
             'c11e': Callable[
@@ -405,10 +779,12 @@ class Module(MetaModule):
                 int, bool, Optional[int],
                 Optional[str], Optional[int]
             ], 'Context'],
-            'ctx_upd': Callable[['Context'], 'Context'],
+            'ctx_upd': Callable[['Context', bool, bool, bool], 'Context'],
             'ctx_delete': Callable[['Context'], None],
             'ctx_get_by_aid': Callable[[int], 'Context'],
             'ctx_get_by_voice': Callable[[int], 'Context'],
             'ctx_get_by_logid': Callable[[int], 'Context'],
-            'ctx_delete_by_voice': Callable[[int], None]
+            'ctx_delete_by_voice': Callable[[int], None],
+            'ctx_cache_stats': Callable[[], dict[str, int]],
+            'ctx_flush': Callable[[], None]
         })
@@ -2,64 +2,314 @@
     Lock API for UStorage
 """
 
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from typing import Any, Optional
-from datetime import datetime
+from weakref import WeakValueDictionary
+from enum import IntEnum
+import itertools
 import traceback
+import bisect
+import logging
 import asyncio
 import time
 
-from asyncpg.connection import Connection
-from asyncpg import Record
+from asyncpg.pool import Pool
 
 from stub import MetaClient, MetaModule
 import stub
 
 
+class LockTimeout(Exception):
+    """
+    Raised by `Module.acquire_lock` when the lock of a chat
+    can't be acquired in `LockSt_AcquireTimeout` seconds
+    """
+
+
+class StaleLock(Exception):
+    """
+    Raised by fenced storage writes (see `Module.fenced`) when
+    the lease of their lock expired or was taken over
+    """
+
+
+class LockLevel(IntEnum):
+    """
+    Lock modes: many `SHARED` holders (read-only handlers) can
+    hold the lock of a chat at the same time, `EXCLUSIVE` ones
+    hold it alone
+    """
+
+    SHARED = 0
+    EXCLUSIVE = 1
+
+
+class ChatRWLock:
+    """
+    In-process reader/writer lock of a chat
+
+    Waiting writers block new readers, so writers aren't starved
+    by a steady flow of readers.
+    """
+
+    def __init__(self):
+        self.cond: asyncio.Condition = asyncio.Condition()
+        self.readers: int = 0
+        self.writer: bool = False
+        self.writers_waiting: int = 0
+
+    def available(self, level: int) -> bool:
+        if level == LockLevel.SHARED:
+            return not self.writer and not self.writers_waiting
+        return not self.writer and not self.readers
+
+    async def acquire(self, level: int) -> None:
+        async with self.cond:
+            if level == LockLevel.SHARED:
+                await self.cond.wait_for(lambda: self.available(level))
+                self.readers += 1
+                return
+
+            self.writers_waiting += 1
+            try:
+                await self.cond.wait_for(lambda: self.available(level))
+
+            finally:
+                self.writers_waiting -= 1
+
+                # Readers may be waiting only for this writer
+                self.cond.notify_all()
+
+            self.writer = True
+
+    async def release(self, level: int) -> None:
+        async with self.cond:
+            if level == LockLevel.SHARED:
+                self.readers -= 1
+
+            else:
+                self.writer = False
+            self.cond.notify_all()
+
+
+class LockHistogram:
+    """
+    Bucketed histogram (`bounds` are the upper bounds of the
+    buckets, the last one takes everything above them)
+    """
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds: tuple[float, ...] = bounds
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.count: int = 0
+        self.total: float = 0
+        self.max: float = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket of the `q` quantile (capped
+        by the max. observed value)"""
+
+        seen: int = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen and seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip(
+                [str(x) for x in self.bounds] + ['inf'], self.counts))
+        }
+
+
+class LockStats:
+    """
+    Lock metrics of a scope (the whole bot, a chat or a handler)
+    - wait      -> Seconds waited by the acquisitions
+    - hold      -> Seconds the locks were held
+    - retries   -> Times each acquisition found the lock taken
+    - busy      -> Non-waiting acquisitions that found it taken
+    - timeouts  -> Waiting acquisitions that timed out
+    - takeovers -> Expired leases taken over by waiters
+    """
+
+    seconds: tuple[float, ...] = (
+        0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+    attempts: tuple[float, ...] = (0, 1, 2, 4, 8, 16)
+
+    def __init__(self):
+        self.wait: LockHistogram = LockHistogram(self.seconds)
+        self.hold: LockHistogram = LockHistogram(self.seconds)
+        self.retries: LockHistogram = LockHistogram(self.attempts)
+        self.busy: int = 0
+        self.timeouts: int = 0
+        self.takeovers: int = 0
+
+    def score(self, metric: str) -> float:
+        value: Any = getattr(self, metric)
+        if isinstance(value, LockHistogram):
+            return value.total
+        return value
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'wait': self.wait.summary(),
+            'hold': self.hold.summary(),
+            'retries': self.retries.summary(),
+            'busy': self.busy,
+            'timeouts': self.timeouts,
+            'takeovers': self.takeovers
+        }
+
+
 @dataclass
 class ChatLock:
     """
-    Basic data structure for Chat Locks
-    It holds two parameters:
-    - level:int     -> The current lock level
-    - timestamp:int -> ChatLock creation time
+    A lock held by this process
+    - lock_id:int         -> Unique id of the acquisition (with
+                             `LockSt_MultiProcess`, a fencing token)
+    - level:int           -> The lock level (see `LockLevel`)
+    - timestamp:float     -> Lock acquisition time
+    - local:ChatRWLock    -> The in-process lock of the chat
+    - task:Task           -> The task that acquired it
+    - conn                -> The connection that holds the DB lock
+                             (only with `LockSt_MultiProcess`)
+    - heartbeat:Task      -> The lease renewal task (only on DB
+                             exclusive locks)
+    - lost:bool           -> Set once the lease can't be renewed
+    - owner:str           -> The handler that acquired it (if any)
+    - acquired:float      -> Monotonic acquisition time
+    - retries:int         -> Times it was found taken while acquiring
     """
 
+    lock_id: int
     level: int
-    timestamp: int
-
-ChatLockTuple = tuple[int, int]
+    timestamp: float
+    local: ChatRWLock
+    task: Optional[asyncio.Task] = None
+    conn: Optional[Any] = None
+    heartbeat: Optional[asyncio.Task] = None
+    lost: bool = False
+    owner: Optional[str] = None
+    acquired: float = 0
+    retries: int = 0
 
 
 class Module(MetaModule):
     """
     Lock API Module
 
-    Provides methods for saving Lock Data to the DB,
-    allowing the bot to have lock states. In those
-    states, the bot will not answer any operation
-    that blocks the logic, or acceses logic of the
-    same level.
+    Chat locks are taken on an in-process reader/writer lock
+    first (kept on a weak-valued registry, so the ones of idle
+    chats are garbage collected). If more than one bot process is
+    configured (`LockSt_MultiProcess`), a Postgres advisory lock
+    keyed by `voice_id` (shared or exclusive, as the local one)
+    is taken too, held by a connection of a dedicated pool (so
+    waiting for or holding locks doesn't starve the storage pool).
+    Those are released by the server when the connection that
+    holds them dies.
+
+    On that mode, every acquisition gets a fencing token (its
+    lock_id) from a DB sequence, and exclusive holders keep a
+    short lease on `Telegram.ChatLease` (renewed in background
+    every third of `LockSt_LeaseTTL`). Waiters terminate the
+    connection of holders whose lease expired (stuck processes),
+    and storage writes made through `fenced` are rejected once
+    a newer token took the chat over.
+
+    Wait & hold times, retries and timeouts are recorded for the
+    whole bot, every chat and every handler (see `lock_stats` &
+    `lock_ranking`).
     """
 
     goodies: MetaModule
+    i18n: MetaModule
+
+    query_lock: list[str] = [
+        '''
+            SELECT nextval('Telegram.LockFence')
+                FROM pg_advisory_lock_shared($1);
+        ''',
+        'SELECT true FROM pg_advisory_lock($1);'
+    ]
+
+    query_try: list[str] = [
+        '''
+            SELECT CASE WHEN pg_try_advisory_lock_shared($1)
+                THEN nextval('Telegram.LockFence') END;
+        ''',
+        'SELECT pg_try_advisory_lock($1);'
+    ]
+
+    query_unlock: list[str] = [
+        'SELECT pg_advisory_unlock_shared($1);',
+        'SELECT pg_advisory_unlock($1);'
+    ]
+
+    query_grant: str = '''
+        INSERT INTO Telegram.ChatLease (voice_id, token, pid, expires)
+            VALUES (
+                $1, nextval('Telegram.LockFence'), pg_backend_pid(),
+                now() + make_interval(secs => $2)
+            )
+            ON CONFLICT (voice_id) DO UPDATE SET
+                token = excluded.token,
+                pid = excluded.pid,
+                expires = excluded.expires
+            RETURNING token;
+    '''
+
+    query_renew: str = '''
+        UPDATE Telegram.ChatLease
+            SET expires = now() + make_interval(secs => $3)
+            WHERE voice_id = $1 AND token = $2
+            RETURNING token;
+    '''
 
-    query_upd: str = '''
-        INSERT INTO Telegram.ChatLock
-        VALUES ($1, $2)
-        ON CONFLICT (voice_id) DO
-        UPDATE SET data=$2
+    query_release: str = '''
+        DELETE FROM Telegram.ChatLease
+            WHERE voice_id = $1 AND token = $2;
     '''
 
-    query_get: str = '''
-        SELECT data FROM Telegram.ChatLock
-        WHERE voice_id=$1
+    # Only backends that still hold an advisory lock are terminated
+    # (the pid of a dead holder may have been reused)
+    query_reap: str = '''
+        SELECT pg_terminate_backend(lease.pid)
+            FROM Telegram.ChatLease lease
+            WHERE lease.voice_id = $1 AND lease.expires < now()
+                AND EXISTS (
+                    SELECT 1 FROM pg_locks
+                        WHERE pid = lease.pid
+                            AND locktype = 'advisory' AND granted
+                            -- The (bigint) advisory lock of the chat
+                            AND classid = (($1::bigint >> 32)
+                                & x'ffffffff'::bigint)::oid
+                            AND objid = ($1::bigint
+                                & x'ffffffff'::bigint)::oid
+                            AND objsubid = 1
+                );
     '''
 
-    query_del: str = '''
-        DELETE FROM Telegram.ChatLock
-        WHERE voice_id=$1
+    query_fence: str = '''
+        SELECT token = $2 AND expires > now()
+            FROM Telegram.ChatLease
+            WHERE voice_id = $1
+            FOR SHARE;
     '''
 
 
@@ -68,23 +318,26 @@ class Module(MetaModule):
         self.client: MetaClient = client
         self.db: MetaModule = db
 
+        self.pool: Optional[Pool] = None
+        self.held: dict[int, dict[int, ChatLock]] = {}
+        self.local: WeakValueDictionary[int, ChatRWLock] = \
+            WeakValueDictionary()
+        self.ids: itertools.count = itertools.count(1)
+
+        self.stats: LockStats = LockStats()
+        self.chat_stats: dict[int, LockStats] = {}
+        self.owner_stats: dict[str, LockStats] = {}
+
     async def setup(self) -> None:
-        async with self.db.pool.acquire() as conn:
+        async with self.db.connection() as conn:
             async with conn.transaction():
                 await conn.execute('''
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'lockdata') THEN
-                            CREATE TYPE Telegram.LockData AS (
-                                level integer,
-                                timestamp timestamp
-                            );
-                        END IF;
-                    END $$;
-
-                    CREATE TABLE Telegram.ChatLock (
-                        voice_id bigint unique,
-                        data Telegram.LockData
+                    CREATE SEQUENCE Telegram.LockFence;
+                    CREATE TABLE Telegram.ChatLease (
+                        voice_id bigint PRIMARY KEY,
+                        token bigint,
+                        pid integer,
+                        expires timestamp with time zone
                     );
                 ''')
 
@@ -94,45 +347,45 @@ class Module(MetaModule):
         self.db.lock_chat = self.lock_chat
         self.db.lock_time = self.lock_time
         self.db.use_lock = self.use_lock
+        self.db.fenced = self.fenced
+        self.db.lock_stats = self.lock_stats
+        self.db.lock_ranking = self.lock_ranking
+        self.db.LockTimeout = LockTimeout
+        self.db.StaleLock = StaleLock
+        self.db.LockLevel = LockLevel
 
         self.client.register_configuration(self, {
-            'LockSt_AutoUnlock': True,
-            'LockSt_Threeshold': 240,
-            'LockSt_AcquireTries': 10,
-            'LockSt_AcquireSleep': 500
+            'LockSt_AcquireTimeout': 30,
+            'LockSt_MultiProcess': False,
+            'LockSt_PoolSize': 20,
+            'LockSt_LeaseTTL': 10,
+            'LockSt_StatsChats': 4096
         })
 
     async def post_install(self) -> None:
-        self.goodies, = self.client.require_modules(('Goodies',))
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute('''
-                    DELETE FROM Telegram.ChatLock;
-                ''')
+        self.goodies, self.i18n = self.client.require_modules(
+            ('Goodies', 'I18n'))
+        if self.client.config['LockSt_MultiProcess']:
+            self.pool = await self.db.new_pool(
+                min_size=1,
+                max_size=int(self.client.config['LockSt_PoolSize']))
 
-    async def db_init(self, conn: Connection) -> None:
-        def encoder(data: ChatLock) -> ChatLockTuple:
-            return data.level, data.timestamp
+    async def shutdown(self) -> None:
+        for locks in self.held.values():
+            for lock in locks.values():
+                if lock.heartbeat is not None:
+                    lock.heartbeat.cancel()
 
-        def decoder(data: ChatLockTuple) -> ChatLock:
-            return ChatLock(
-                level=data[0],
-                timestamp=data[1]
-            )
-
-        await conn.set_type_codec(
-            typename='lockdata',
-            schema='telegram',
-            format='tuple',
-            encoder=encoder,
-            decoder=decoder
-        )
+        if self.pool:
+            await self.pool.close()
 
 
     async def lock_chat(
         self, context: 'stub.Context',
-        lock_level: int = 1
-    ) -> float:
+        lock_level: int = LockLevel.EXCLUSIVE,
+        timeout: Optional[float] = 0,
+        owner: Optional[str] = None
+    ) -> Optional[int]:
         """Locks a chat
 
         Parameters
@@ -140,25 +393,185 @@ class Module(MetaModule):
         context
             The context of the chat
         lock_level
-            Target lock level
+            Target lock level (see `LockLevel`)
+        timeout
+            Seconds to wait for the lock (0 doesn't wait at all,
+            None waits forever)
+        owner
+            The handler name the lock metrics are recorded under
 
         Returns
         -------
-        float
-            The timestamp of the lock event (used as a lock_id)
+        int | None
+            The lock_id (for `unlock_chat`, and a fencing token
+            with `LockSt_MultiProcess`), or None if the lock is
+            taken
         """
 
-        key: datetime
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                key = datetime.now()
-                await conn.execute(self.query_upd,
-                    context.voice_id, ChatLock(lock_level, key))
+        level: int = LockLevel(lock_level)
+        local: ChatRWLock = self.local_lock(context.voice_id)
+        lock: ChatLock = ChatLock(
+            0, level, time.time(), local, asyncio.current_task(),
+            owner=owner)
 
-        return key.timestamp()
+        start: float = time.monotonic()
+        if not local.available(level):
+            lock.retries += 1
+            if timeout == 0:
+                self.record_failure(context.voice_id, lock, timeout)
+                return None
+
+        if timeout == 0:
+            await local.acquire(level)
+
+        else:
+            try:
+                await asyncio.wait_for(local.acquire(level), timeout)
+
+            except asyncio.TimeoutError:
+                self.record_failure(context.voice_id, lock, timeout)
+                return None
+
+        if self.pool is None:
+            lock.lock_id = next(self.ids)
+
+        else:
+            # The DB lock gets what's left of the timeout
+            remaining: Optional[float] = timeout
+            if timeout:
+                remaining = max(0, timeout - (time.monotonic() - start))
+
+            locked: bool = False
+            try:
+                locked = await self.db_lock(
+                    context.voice_id, lock, remaining)
+
+            finally:
+                if not locked:
+                    await local.release(level)
+
+            if not locked:
+                self.record_failure(context.voice_id, lock, timeout)
+                return None
+
+            if level == LockLevel.EXCLUSIVE:
+                lock.heartbeat = asyncio.create_task(
+                    self.heartbeat_routine(context.voice_id, lock))
+
+        lock.acquired = time.monotonic()
+        for stats in self.scopes(context.voice_id, owner):
+            stats.wait.observe(lock.acquired - start)
+            stats.retries.observe(lock.retries)
+
+        self.held.setdefault(context.voice_id, {})[lock.lock_id] = lock
+        return lock.lock_id
+
+    def local_lock(self, voice_id: int) -> ChatRWLock:
+        lock: Optional[ChatRWLock] = self.local.get(voice_id)
+        if lock is None:
+            lock = self.local[voice_id] = ChatRWLock()
+        return lock
+
+    async def db_lock(
+        self, voice_id: int, lock: ChatLock,
+        timeout: Optional[float]
+    ) -> bool:
+        """Takes the DB lock (setting the connection & token of
+        `lock`), returns whether it was acquired"""
+
+        level: int = lock.level
+        ttl: float = float(self.client.config['LockSt_LeaseTTL'])
+        deadline: Optional[float] = None if not timeout \
+            else time.monotonic() + timeout
+
+        # Waiting for a connection of the lock pool counts as
+        # waiting for the lock (try-locks don't wait for it at all)
+        if timeout == 0 and not self.pool.get_idle_size() and \
+                self.pool.get_size() >= self.pool.get_max_size():
+            return False
+
+        try:
+            conn: Any = await self.pool.acquire(timeout=timeout or None)
+
+        except asyncio.TimeoutError:
+            return False
+
+        try:
+            token: Any = None
+            if timeout == 0:
+                token = await conn.fetchval(self.query_try[level], voice_id)
+
+            else:
+                while not token:
+                    wait: float = ttl if deadline is None \
+                        else min(ttl, deadline - time.monotonic())
+                    if wait <= 0:
+                        break
+
+                    try:
+                        # On timeouts the query is cancelled on the server
+                        token = await conn.fetchval(
+                            self.query_lock[level], voice_id, timeout=wait)
+
+                    except asyncio.TimeoutError:
+                        lock.retries += 1
+
+                        # The holder may be stuck, with its lease expired
+                        if await conn.fetchval(self.query_reap, voice_id):
+                            logging.warning(
+                                'The lease of `%d` expired, its holder '
+                                'was disconnected', voice_id)
+                            for stats in self.scopes(voice_id, lock.owner):
+                                stats.takeovers += 1
+
+            if not token:
+                await self.pool.release(conn)
+                return False
+
+            if level == LockLevel.EXCLUSIVE:
+                token = await conn.fetchval(self.query_grant, voice_id, ttl)
+
+        except BaseException:
+            # Releasing the connection drops its advisory locks
+            await self.pool.release(conn)
+            raise
+
+        lock.conn, lock.lock_id = conn, token
+        return True
+
+    async def heartbeat_routine(self, voice_id: int, lock: ChatLock) -> None:
+        ttl: float = float(self.client.config['LockSt_LeaseTTL'])
+        while True:
+            await asyncio.sleep(ttl / 3)
+
+            try:
+                renewed: Optional[int] = await lock.conn.fetchval(
+                    self.query_renew, voice_id, lock.lock_id, ttl)
+
+            except Exception:
+                # Terminated by a waiter (see `query_reap`), or dead
+                if lock.conn.is_closed():
+                    lock.lost = True
+                    logging.warning(
+                        'The lease of `%d` (token %d) was lost, its '
+                        'connection was closed', voice_id, lock.lock_id)
+                    return
+
+                # Retried on the next beat, as the lease is still
+                # valid until someone else takes the chat over
+                logging.exception('Can\'t renew the lease of `%d`', voice_id)
+                continue
+
+            if renewed is None:
+                lock.lost = True
+                logging.warning(
+                    'The lease of `%d` (token %d) was taken over',
+                    voice_id, lock.lock_id)
+                return
 
     async def unlock_chat(
-        self, context: 'stub.Context'
+        self, context: 'stub.Context',
+        lock_id: Optional[int] = None
     ) -> None:
         """Unlocks a chat
 
@@ -166,16 +579,63 @@ class Module(MetaModule):
         ----------
         context
             The context of the chat
+        lock_id
+            The lock to release (by default, the last acquired
+            one of the chat)
         """
 
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute(self.query_del, context.voice_id)
+        locks: Optional[dict[int, ChatLock]] = \
+            self.held.get(context.voice_id)
+        if not locks:
+            return
+
+        lock: Optional[ChatLock] = locks.pop(
+            lock_id if lock_id is not None else next(reversed(locks)),
+            None)
+        if not locks:
+            del self.held[context.voice_id]
+
+        if lock is None:
+            return
+
+        for stats in self.scopes(context.voice_id, lock.owner):
+            stats.hold.observe(time.monotonic() - lock.acquired)
+
+        try:
+            if lock.heartbeat is not None:
+                lock.heartbeat.cancel()
+                await asyncio.gather(lock.heartbeat, return_exceptions=True)
+
+            if lock.conn is not None:
+                await self.db_unlock(context.voice_id, lock)
+
+        finally:
+            await lock.local.release(lock.level)
+
+    async def db_unlock(self, voice_id: int, lock: ChatLock) -> None:
+        try:
+            # Its locks were dropped with it
+            if lock.conn.is_closed():
+                return
+
+            if lock.level == LockLevel.EXCLUSIVE and not lock.lost:
+                await lock.conn.execute(
+                    self.query_release, voice_id, lock.lock_id)
+            await lock.conn.fetchval(self.query_unlock[lock.level], voice_id)
+
+        except Exception:
+            # The pool resets the connection on release (which
+            # drops its advisory locks), so it's just logged
+            logging.exception('Can\'t unlock `%d`', voice_id)
+
+        finally:
+            await self.pool.release(lock.conn)
 
     async def lock_time(
         self, context: 'stub.Context'
     ) -> Optional[float]:
-        """Retrieves the timestamp of the last lock
+        """Retrieves the timestamp of the oldest lock held by
+        this process
 
         Parameters
         ----------
@@ -185,96 +645,287 @@ class Module(MetaModule):
         Returns
         -------
         float | None
-            the timestamp of the lock event (used as a lock_id)
-            (if it exist's)
+            the timestamp of the lock event (if it exist's)
         """
 
-        ltime: Optional[float] = None
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                record: Optional[Record] = await conn.fetchrow(
-                    self.query_get, context.voice_id)
-
-                if record:
-                    ltime = record['data'].timestamp.timestamp()
-        return ltime
+        locks: Optional[dict[int, ChatLock]] = \
+            self.held.get(context.voice_id)
+        return locks and next(iter(locks.values())).timestamp or None
 
     async def acquire_lock(
         self, context: 'stub.Context',
-        lock_level: int = 1
-    ) -> float:
-        sleep_time: float = self.client.config['LockSt_AcquireSleep'] / 1000
-        acquire_tries: int = self.client.config['LockSt_AcquireTries']
-        auto_unlock: bool = self.client.config['LockSt_AutoUnlock']
-        threeshold: int = self.client.config['LockSt_Threeshold']
-
-        times: int = 0
-        while times < acquire_tries:
-            if times > 0:
-                await asyncio.sleep(sleep_time)
-            times += 1
-
-            lockt: Optional[float] = await self.lock_time(context)
-            if lockt:
-                if not auto_unlock or (time.time() - lockt) <= threeshold:
-                    continue
-
-                await self.unlock_chat(context)
-
-            lock_id: float = await self.lock_chat(context, lock_level)
-            await asyncio.sleep(0.1)
-
-            if lock_id != await self.lock_time(context):
-                continue
+        lock_level: int = LockLevel.EXCLUSIVE,
+        owner: Optional[str] = None,
+        timeout: Optional[float] = -1
+    ) -> int:
+        """Waits for the lock of a chat
 
-            return lock_id
+        Parameters
+        ----------
+        timeout
+            Seconds to wait for the lock (`LockSt_AcquireTimeout`
+            if negative, None waits forever)
 
-        # 'Brute force' the Lock Mechanism
-        # TODO: Test the case of 4 threads trying to acquire lock
-        #       at the same time
+        Returns
+        -------
+        int
+            The lock_id (for `unlock_chat`)
 
-        lock_id: float
-        while True:
-            lock_id = await self.lock_chat(context, lock_level)
-            await asyncio.sleep(0.1)
-            if lock_id == await self.lock_time(context):
-                break
+        Raises
+        ------
+        LockTimeout
+            If the lock isn't acquired in time
+        """
 
+        if timeout is not None and timeout < 0:
+            timeout = self.client.config['LockSt_AcquireTimeout']
+
+        lock_id: Optional[int] = await self.lock_chat(
+            context, lock_level, timeout, owner)
+
+        if lock_id is None:
+            raise LockTimeout(context.voice_id)
         return lock_id
 
+    def scopes(
+        self, voice_id: int,
+        owner: Optional[str]
+    ) -> list[LockStats]:
+        chat: Optional[LockStats] = self.chat_stats.get(voice_id)
+        if chat is None:
+            # The oldest chats are dropped, so they're kept bounded
+            if len(self.chat_stats) >= \
+                    self.client.config['LockSt_StatsChats']:
+                del self.chat_stats[next(iter(self.chat_stats))]
+            chat = self.chat_stats[voice_id] = LockStats()
+
+        out: list[LockStats] = [self.stats, chat]
+        if owner is not None:
+            out.append(self.owner_stats.setdefault(owner, LockStats()))
+        return out
+
+    def record_failure(
+        self, voice_id: int, lock: ChatLock,
+        timeout: Optional[float]
+    ) -> None:
+        for stats in self.scopes(voice_id, lock.owner):
+            if timeout == 0:
+                stats.busy += 1
+
+            else:
+                stats.timeouts += 1
+
+    def lock_stats(
+        self, voice_id: Optional[int] = None,
+        owner: Optional[str] = None
+    ) -> Optional[dict[str, Any]]:
+        """Gets the lock metrics
+
+        Parameters
+        ----------
+        voice_id
+            Get the ones of a chat
+        owner
+            Get the ones of a handler
+
+        Returns
+        -------
+        dict | None
+            The summary of the metrics (see `LockStats`), the
+            global ones if no scope is given, or None if the
+            scope has no locks recorded
+        """
+
+        stats: Optional[LockStats] = self.stats
+        if voice_id is not None:
+            stats = self.chat_stats.get(voice_id)
+
+        elif owner is not None:
+            stats = self.owner_stats.get(owner)
+        return stats.summary() if stats else None
+
+    def lock_ranking(
+        self, metric: str = 'hold',
+        by: str = 'chat',
+        limit: int = 10
+    ) -> list[tuple[int | str, dict[str, Any]]]:
+        """Ranks the chats (or handlers) that serialize the bot
+
+        Parameters
+        ----------
+        metric
+            `wait` or `hold` (ranked by total seconds), `retries`,
+            `busy`, `timeouts` or `takeovers`
+        by
+            `chat` or `owner` (handlers)
+        limit
+            Max. amount of entries
+
+        Returns
+        -------
+        list[tuple[int | str, dict]]
+            The voice_ids (or handler names) with their metrics
+        """
+
+        scopes: dict[Any, LockStats] = \
+            self.chat_stats if by == 'chat' else self.owner_stats
+        ranked: list[tuple[Any, LockStats]] = sorted(
+            scopes.items(), key=lambda x: x[1].score(metric),
+            reverse=True)[:limit]
+        return [(key, stats.summary()) for key, stats in ranked]
+
+    def fencing_lock(
+        self, voice_id: int,
+        lock_id: Optional[int] = None
+    ) -> Optional[ChatLock]:
+        locks: dict[int, ChatLock] = self.held.get(voice_id, {})
+        if lock_id is not None:
+            lock: Optional[ChatLock] = locks.get(lock_id)
+            return lock if lock and lock.heartbeat else None
+
+        task: Optional[asyncio.Task] = asyncio.current_task()
+        for lock in locks.values():
+            if lock.heartbeat and lock.task is task:
+                return lock
+        return None
+
+    @asynccontextmanager
+    async def fenced(
+        self, voice_id: int,
+        lock_id: Optional[int] = None
+    ) -> AsyncIterator[None]:
+        """Runs storage writes inside of a transaction that is
+        only committed if the lock they're made under still holds
+        the lease of its chat
+
+        Parameters
+        ----------
+        voice_id
+            The chat the writes are made on
+        lock_id
+            The lock they're made under (by default, the exclusive
+            lock held by the current task)
+
+        Raises
+        ------
+        StaleLock
+            If a newer token took the chat over (or the lease
+            expired)
+
+        Notes
+        -----
+        Without `LockSt_MultiProcess` (or outside of an exclusive
+        lock) nothing is checked. That's on purpose for the writes
+        made by background tasks that outlive the handler lock
+        (e.g. `Player.enqueue_routine`), as there is no lease left
+        to check them against
+        """
+
+        lock: Optional[ChatLock] = self.fencing_lock(voice_id, lock_id)
+        if lock is None:
+            yield
+            return
+
+        if lock.lost:
+            raise StaleLock(voice_id)
+
+        # The lease row is kept share-locked until the writes are
+        # committed, so it can't be taken over in between
+        async with self.db.unit_of_work(transaction=True):
+            async with self.db.connection() as conn:
+                valid: Optional[bool] = await conn.fetchval(
+                    self.query_fence, voice_id, lock.lock_id)
+
+            if not valid:
+                lock.lost = True
+                raise StaleLock(voice_id)
+            yield
+
 
     def use_lock(
         self, method: Callable,
-        lock_level: int = 1
+        lock_level: int = LockLevel.EXCLUSIVE
     ) -> Callable:
+        """Runs a handler holding the lock of its chat
+
+        Parameters
+        ----------
+        method
+            The handler (its third argument must be the context)
+        lock_level
+            `LockLevel.SHARED` for read-only handlers, and
+            `LockLevel.EXCLUSIVE` for the other ones
+
+        Notes
+        -----
+        Exclusive handlers wait for the lock for as long as it's
+        held, as they change the player. Shared ones give up after
+        `LockSt_AcquireTimeout` seconds, telling the chat to try
+        again
+        """
+
+        timeout: Optional[float] = \
+            None if lock_level == LockLevel.EXCLUSIVE else -1
+
         async def new_method(*args, **kwargs) -> Any:
             use_lock: bool = True
             if 'use_lock' in kwargs:
                 use_lock = kwargs.pop('use_lock') is not False
 
             context = args[2]
+            lock_id: Optional[int] = None
             if use_lock:
-                await self.acquire_lock(context, lock_level)
+                try:
+                    lock_id = await self.acquire_lock(
+                        context, lock_level, method.__name__, timeout)
+
+                except LockTimeout:
+                    logging.warning(
+                        'Lock of `%d` timed out, `%s` wasn\'t run',
+                        context.voice_id, method.__name__)
+                    await self.goodies.update_status(
+                        context, self.i18n[context]['lk_busy'])
+                    return None
 
             data: Any = None
             try:
                 data = await method(*args, **kwargs)
 
+            except StaleLock:
+                logging.warning(
+                    'Lease of `%d` was lost, `%s` was stopped',
+                    context.voice_id, method.__name__)
+
             except Exception as e:
                 await self.goodies.report_error(
                     context, e, traceback.format_exc(),
                     method.__name__)
 
-            if use_lock:
-                await self.unlock_chat(context)
+            finally:
+                if lock_id is not None:
+                    await self.unlock_chat(context, lock_id)
             return data
         return new_method
 
 
     def stub(self, root: dict[str, Any]) -> None:
         root['ustorage'].update({
-            'lock_chat': Callable[['stub.Context', int], float],
-            'unlock_chat': Callable[['stub.Context'], None],
+            'acquire_lock': Callable[
+                ['stub.Context', int, Optional[str], Optional[float]],
+                int],
+            'lock_chat': Callable[
+                ['stub.Context', int, Optional[float], Optional[str]],
+                Optional[int]],
+            'unlock_chat': Callable[['stub.Context', Optional[int]], None],
             'lock_time': Callable[['stub.Context'], Optional[float]],
-            'use_lock': Callable[[Callable, int], Callable]
+            'use_lock': Callable[[Callable, int], Callable],
+            'fenced': Callable[[int, Optional[int]], Any],
+            'lock_stats': Callable[
+                [Optional[int], Optional[str]], Optional[dict[str, Any]]],
+            'lock_ranking': Callable[[str, str, int], list[tuple]],
+            'LockLevel': {
+                '__name__': 'LockLevel',
+                'SHARED': int,
+                'EXCLUSIVE': int
+            }
         })
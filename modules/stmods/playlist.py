@@ -2,10 +2,16 @@
     Playlist API for UStorage
 """
 
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import (
+    AsyncIterable, AsyncIterator, Callable,
+    Iterable, Iterator
+)
+from dataclasses import dataclass, astuple
 from typing import Optional, Any
+import itertools
+import json
 
+from asyncpg.prepared_stmt import PreparedStatement
 from asyncpg.connection import Connection
 from asyncpg import Record
 
@@ -40,52 +46,60 @@ class Module(MetaModule):
     storing the current playlist size and position.
     """
 
+    # Both, `PlStatus` & `Playlist` are modified on the same
+    # statement (the `PlStatus` row lock serializes concurrent
+    # enqueues of the same playlist)
     query_enqueue: str = \
         '''
-            INSERT INTO Player.Playlist VALUES (
-                $1, $2::player.songdata, $3
-            );
-        '''
-
-    query_dequeue: str = \
-        '''
-            SELECT data FROM Player.Playlist
-            WHERE id = (
-                SELECT position FROM Player.PlStatus
-                WHERE voice_id = $1
-            ) AND voice_id = $1;
+            WITH status AS (
+                INSERT INTO Player.PlStatus AS st
+                VALUES ($1, 1, 0)
+                ON CONFLICT (voice_id) DO UPDATE
+                    SET size = st.size + 1
+                RETURNING size
+            )
+            INSERT INTO Player.Playlist
+            SELECT $1::bigint, $2::player.songdata, size - 1
+            FROM status;
         '''
 
-    query_next: str = \
+    query_enqueue_many: str = \
         '''
-            UPDATE Player.PlStatus
-            SET position = 1 + (
-                SELECT position FROM Player.PlStatus
-                WHERE voice_id = $1
-            ) WHERE voice_id = $1
-            RETURNING position;
+            WITH status AS (
+                INSERT INTO Player.PlStatus AS st
+                VALUES ($1, cardinality($2::player.songdata[]), 0)
+                ON CONFLICT (voice_id) DO UPDATE
+                    SET size = st.size + excluded.size
+                RETURNING size
+            )
+            INSERT INTO Player.Playlist
+            SELECT
+                $1::bigint, ($2::player.songdata[])[idx],
+                size - cardinality($2::player.songdata[]) + idx - 1
+            FROM status, generate_subscripts(
+                $2::player.songdata[], 1) AS idx
+            ORDER BY idx;
         '''
 
-    query_ustatus: str = \
+    query_dequeue: str = \
         '''
-            UPDATE Player.PlStatus SET size = 1 + (
-                SELECT size FROM Player.PlStatus
+            WITH status AS (
+                UPDATE Player.PlStatus
+                SET position = position + 1
                 WHERE voice_id = $1
-            ) WHERE voice_id = $1;
-        '''
-
-    query_istatus: str = \
-        '''
-            INSERT INTO Player.PlStatus
-            VALUES ($1, 1, 0);
+                RETURNING position - 1 AS position
+            )
+            SELECT status.position, playlist.data
+            FROM status JOIN Player.Playlist AS playlist
+                ON playlist.voice_id = $1
+                AND playlist.id = status.position;
         '''
 
     query_fetch: str = \
         '''
-            SELECT data FROM Player.Playlist
-            WHERE voice_id = $1
-            ORDER BY ctid
-            OFFSET $2
+            SELECT id, data FROM Player.Playlist
+            WHERE voice_id = $1 AND id >= $2
+            ORDER BY id
             LIMIT $3;
         '''
 
@@ -100,6 +114,30 @@ class Module(MetaModule):
         '''
     ]
 
+    # Locks the `PlStatus` row (creating it if needed) for an
+    # import, so its ids can't collide with concurrent enqueues
+    query_import_begin: str = \
+        '''
+            INSERT INTO Player.PlStatus AS st
+            VALUES ($1, 0, 0)
+            ON CONFLICT (voice_id) DO UPDATE
+                SET size = st.size
+            RETURNING size;
+        '''
+
+    query_import_end: str = \
+        '''
+            UPDATE Player.PlStatus SET size = $2
+            WHERE voice_id = $1;
+        '''
+
+    query_export: str = \
+        '''
+            SELECT data FROM Player.Playlist
+            WHERE voice_id = $1 AND id >= $2
+            ORDER BY id;
+        '''
+
     query_size: str = \
         '''
             SELECT size FROM Player.PlStatus
@@ -119,7 +157,7 @@ class Module(MetaModule):
         self.db: MetaModule = db
 
     async def setup(self) -> None:
-        async with self.db.pool.acquire() as conn:
+        async with self.db.connection() as conn:
             async with conn.transaction():
                 await conn.execute('''
                     DROP SCHEMA IF EXISTS Player CASCADE;
@@ -144,8 +182,10 @@ class Module(MetaModule):
                         data Player.SongData,
                         id integer
                     );
+                    CREATE UNIQUE INDEX Playlist_Order
+                        ON Player.Playlist (voice_id, id);
                     CREATE TABLE Player.PlStatus (
-                        voice_id bigint,
+                        voice_id bigint unique,
                         size integer,
                         position integer
                     );
@@ -165,15 +205,21 @@ class Module(MetaModule):
         )
 
         self.db.pl_enqueue = self.pl_enqueue
+        self.db.pl_enqueue_many = self.pl_enqueue_many
+        self.db.pl_import = self.pl_import
+        self.db.pl_export = self.pl_export
+        self.db.pl_encode = self.pl_encode
+        self.db.pl_decode = self.pl_decode
         self.db.pl_dequeue = self.pl_dequeue
         self.db.pl_clean = self.pl_clean
         self.db.pl_fetch = self.pl_fetch
+        self.db.pl_fetch_page = self.pl_fetch_page
 
         self.db.pl_position = self.pl_position
         self.db.pl_size = self.pl_size
 
     async def post_install(self) -> None:
-        async with self.db.pool.acquire() as conn:
+        async with self.db.connection() as conn:
             async with conn.transaction():
                 await conn.execute('''
                     DELETE FROM Player.Playlist;
@@ -204,38 +250,181 @@ class Module(MetaModule):
         self, voice_id: int,
         data: SongData
     ) -> None:
-        async with self.db.pool.acquire() as conn:
+        async with self.db.fenced(voice_id), \
+                self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_enqueue')
+            await stmt.fetch(voice_id, data)
+
+    async def pl_enqueue_many(
+        self, voice_id: int,
+        data: list[SongData]
+    ) -> None:
+        """Enqueues many songs at once (keeping their order)
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        data
+            The songs to enqueue
+        """
+
+        if not data:
+            return
+
+        async with self.db.fenced(voice_id), \
+                self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_enqueue_many')
+            await stmt.fetch(voice_id, data)
+
+    async def pl_import(
+        self, voice_id: int,
+        data: Iterable[SongData] | AsyncIterable[SongData]
+    ) -> int:
+        """Enqueues songs in bulk (streaming them with `COPY`)
+
+        Notes
+        -----
+        The songs are never materialized as a whole, and the
+        playlist size is only updated once, at the end of the import
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        data
+            The songs to enqueue (an iterable, or async iterable)
+
+        Returns
+        -------
+        int
+            The amount of imported songs
+        """
+
+        count: int = 0
+        base: int
+
+        # The first song is peeked, so empty imports don't touch
+        # the playlist (as `pl_enqueue_many`)
+        first: Optional[SongData]
+        songs: Iterator[SongData] | AsyncIterator[SongData]
+        if hasattr(data, '__aiter__'):
+            songs = aiter(data)
+            first = await anext(songs, None)
+
+        else:
+            songs = iter(data)
+            first = next(songs, None)
+
+        if first is None:
+            return 0
+
+        def records() -> Iterator[tuple[int, SongData, int]]:
+            nonlocal count
+            for song in itertools.chain((first,), songs):
+                yield (voice_id, song, base + count)
+                count += 1
+
+        async def arecords() -> AsyncIterator[tuple[int, SongData, int]]:
+            nonlocal count
+            yield (voice_id, first, base + count)
+            count += 1
+            async for song in songs:
+                yield (voice_id, song, base + count)
+                count += 1
+
+        async with self.db.fenced(voice_id), \
+                self.db.connection() as conn:
+            begin: PreparedStatement = await conn.prepared(
+                self, 'query_import_begin')
+            end: PreparedStatement = await conn.prepared(
+                self, 'query_import_end')
+
             async with conn.transaction():
-                size: Optional[int] = await self.pl_size(voice_id)
-                if size is None:
-                    await conn.execute(self.query_istatus, voice_id)
-                    size = 0
+                base = await begin.fetchval(voice_id)
+                await conn.copy_records_to_table(
+                    'playlist', schema_name='player',
+                    columns=('voice_id', 'data', 'id'),
+                    records=arecords() if hasattr(songs, '__anext__')
+                        else records()
+                )
 
-                else:
-                    await conn.execute(self.query_ustatus, voice_id)
+                await end.fetch(voice_id, base + count)
+        return count
 
-                await conn.execute(self.query_enqueue,
-                    voice_id, data, size)
+    def pl_encode(self, data: SongData) -> bytes:
+        """Encodes a song as a line of the export format
 
-    async def pl_dequeue(
-        self, voice_id: int
-    ) -> Optional[tuple[int, SongData]]:
-        data: Optional[SongData] = None
-        index: int = 0
+        Notes
+        -----
+        Each line is a compact JSON array with the `SongData`
+        fields (in declaration order), see `pl_decode`
+        """
 
-        async with self.db.pool.acquire() as conn:
-            async with conn.transaction():
-                row: Record = await conn.fetchrow(
-                    self.query_dequeue, voice_id)
-                idx: Record = await conn.fetchrow(
-                    self.query_next, voice_id)
+        return json.dumps(
+            astuple(data), ensure_ascii=False,
+            separators=(',', ':')
+        ).encode('utf-8') + b'\n'
 
-                if row:
-                    data = row['data']
-                    index = idx['position']
+    def pl_decode(self, line: bytes | str) -> SongData:
+        """Decodes a line of the export format (see `pl_encode`)"""
 
-        if data:
-            return (index - 1, data)
+        return SongData(*json.loads(line))
+
+    async def pl_export(
+        self, voice_id: int,
+        offset: int = 0
+    ) -> AsyncIterator[bytes]:
+        """Exports a playlist, song by song
+
+        Notes
+        -----
+        A server-side cursor is used, so the playlist is never
+        materialized as a whole. The output can be loaded back
+        with `pl_import` (decoding each line with `pl_decode`)
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        offset
+            The playlist id of the first song to export
+
+        Yields
+        ------
+        bytes
+            A line of the export format per song
+        """
+
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_export')
+
+            async with conn.transaction():
+                async for record in stmt.cursor(voice_id, offset):
+                    yield self.pl_encode(record['data'])
+
+    async def pl_dequeue(
+        self, voice_id: int
+    ) -> Optional[tuple[int, SongData]]:
+        """Moves the playlist to its next song
+
+        Returns
+        -------
+        tuple[int, SongData] | None
+            The playlist id & data of the next song, if there is any
+        """
+
+        async with self.db.fenced(voice_id), \
+                self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_dequeue')
+            row: Optional[Record] = await stmt.fetchrow(voice_id)
+
+        if row:
+            return (row['position'], row['data'])
         return None
 
     async def pl_fetch(
@@ -243,33 +432,84 @@ class Module(MetaModule):
         limit: int = 10,
         offset: Optional[int] = None
     ) -> list[SongData]:
+        """Fetches songs from a playlist
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        limit
+            Max amount of songs to fetch
+        offset
+            The playlist id of the first song to fetch (ids are
+            the songs positions), by default it's the current
+            playlist position
+
+        Returns
+        -------
+        list[SongData]
+            The songs, in playlist order
+        """
+
         if offset is None:
             offset = await self.pl_position(voice_id)
 
-        playlist: list[SongData] = []
-        async with self.db.pool.acquire() as conn:
+        return [
+            data for _, data in await self.pl_fetch_page(
+                voice_id, offset - 1, limit)
+        ] if offset is not None else []
+
+    async def pl_fetch_page(
+        self, voice_id: int,
+        after: int = -1,
+        limit: int = 10
+    ) -> list[tuple[int, SongData]]:
+        """Fetches songs from a playlist using keyset pagination
+
+        Parameters
+        ----------
+        voice_id
+            The playlist voice id
+        after
+            The cursor (the last playlist id of the previous page,
+            -1 for the first page)
+        limit
+            Max amount of songs to fetch
+
+        Returns
+        -------
+        list[tuple[int, SongData]]
+            The playlist ids & songs, the last id is the cursor of
+            the next page
+        """
+
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_fetch')
             records: list[Record] = \
-                await conn.fetch(
-                    self.query_fetch, voice_id, offset, limit)
+                await stmt.fetch(voice_id, after + 1, limit)
 
-            for record in records:
-                playlist.append(record['data'])
-        return playlist
+        return [(record['id'], record['data']) for record in records]
 
     async def pl_clean(
         self, voice_id: int
     ) -> None:
-        async with self.db.pool.acquire() as conn:
+        async with self.db.fenced(voice_id), \
+                self.db.connection() as conn:
+            stmts: list[PreparedStatement] = await conn.prepared(
+                self, 'query_clean')
             async with conn.transaction():
-                for stmt in self.query_clean:
-                    await conn.execute(stmt, voice_id)
+                for stmt in stmts:
+                    await stmt.fetch(voice_id)
 
     async def pl_size(
         self, voice_id: int
     ) -> Optional[int]:
         size: Optional[int] = None
-        async with self.db.pool.acquire() as conn:
-            row = await conn.fetchrow(self.query_size, voice_id)
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_size')
+            row = await stmt.fetchrow(voice_id)
             if row:
                 size = row['size']
         return size
@@ -278,8 +518,10 @@ class Module(MetaModule):
         self, voice_id: int
     ) -> Optional[int]:
         position: Optional[int] = None
-        async with self.db.pool.acquire() as conn:
-            row = await conn.fetchrow(self.query_pos, voice_id)
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_pos')
+            row = await stmt.fetchrow(voice_id)
             if row:
                 position = row['position']
         return position
@@ -301,9 +543,16 @@ class Module(MetaModule):
 
             'pl_default_data': Callable[[], 'SongData'],
             'pl_enqueue': Callable[[int, 'SongData'], None],
+            'pl_enqueue_many': Callable[[int, list['SongData']], None],
+            'pl_import': Callable[[int, Iterable['SongData']], int],
+            'pl_export': Callable[[int, int], AsyncIterator[bytes]],
+            'pl_encode': Callable[['SongData'], bytes],
+            'pl_decode': Callable[[bytes | str], 'SongData'],
             'pl_dequeue': Callable[[int], Optional[tuple[int, 'SongData']]],
             'pl_clean': Callable[[int], None],
             'pl_fetch': Callable[[int, int, Optional[int]], list['SongData']],
+            'pl_fetch_page': Callable[
+                [int, int, int], list[tuple[int, 'SongData']]],
             'pl_position': Callable[[int], Optional[int]],
             'pl_size': Callable[[int], Optional[int]]
         })
@@ -0,0 +1,175 @@
+"""
+    Track Metadata Cache API for UStorage
+"""
+
+from collections.abc import Callable
+from dataclasses import replace
+from typing import Optional, Any
+import time
+
+from asyncpg.prepared_stmt import PreparedStatement
+from asyncpg import Record
+
+from stub import MetaClient, MetaModule
+from modules.stmods.cache import LRUCache
+import stub
+
+
+class Module(MetaModule):
+    """
+    Track Metadata Cache Module
+
+    Caches the `SongData` of tracks by their canonical media
+    key (see `Goodies.media_key`), on an in-memory LRU tier
+    backed by the `Player.TrackCache` table. Failed lookups are
+    cached too (negative caching), for a shorter time.
+    """
+
+    query_get: str = \
+        '''
+            SELECT data,
+                    extract(epoch FROM expires - now()) AS remaining
+                FROM Player.TrackCache
+            WHERE key = $1 AND expires > now();
+        '''
+
+    query_put: str = \
+        '''
+            INSERT INTO Player.TrackCache
+            VALUES ($1, $2::player.songdata,
+                now() + make_interval(secs => $3))
+            ON CONFLICT (key) DO UPDATE
+                SET data = excluded.data,
+                    expires = excluded.expires;
+        '''
+
+    query_purge: str = \
+        '''
+            DELETE FROM Player.TrackCache
+            WHERE expires <= now();
+        '''
+
+
+    def __init__(self, client: MetaClient, db: MetaModule):
+        self.identifier: str = 'TrackCache'
+        self.client: MetaClient = client
+        self.db: MetaModule = db
+        self.cache: Optional[LRUCache] = None
+
+    async def setup(self) -> None:
+        async with self.db.connection() as conn:
+            async with conn.transaction():
+                await conn.execute('''
+                    CREATE TABLE Player.TrackCache (
+                        key varchar(256) PRIMARY KEY,
+                        data Player.SongData,
+                        expires timestamp with time zone
+                    );
+                ''')
+
+    async def install(self) -> None:
+        self.client.register_configuration(self, {
+            'TrackCache_Size': 1024,
+            'TrackCache_TTL': 7 * 24 * 60 * 60,
+            'TrackCache_NegativeTTL': 10 * 60
+        })
+
+        self.cache = LRUCache(
+            int(self.client.config['TrackCache_Size']),
+            float(self.client.config['TrackCache_TTL']))
+
+        self.db.tc_get = self.tc_get
+        self.db.tc_put = self.tc_put
+        self.db.tc_stats = self.cache.stats
+
+    async def post_install(self) -> None:
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_purge')
+            await stmt.fetch()
+
+
+    async def tc_get(
+        self, key: str
+    ) -> tuple[bool, Optional['stub.SongData']]:
+        """Gets the cached metadata of a track
+
+        Parameters
+        ----------
+        key
+            The track canonical media key
+
+        Returns
+        -------
+        tuple[bool, SongData | None]
+            If the track is cached, and its `SongData` (None, if
+            the cached entry is a failed lookup)
+        """
+
+        # LRU entries are (expiration, data) tuples, as negative
+        # entries expire before than the LRU ttl
+        entry: Optional[tuple[float, Optional['stub.SongData']]] = \
+            self.cache.get(key)
+
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                return (True, entry[1] and replace(entry[1]))
+            self.cache.pop(key)
+
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_get')
+            row: Optional[Record] = await stmt.fetchrow(key)
+
+        if row is None:
+            return (False, None)
+
+        # Entries cached with a custom ttl keep it
+        data: Optional['stub.SongData'] = row['data']
+        self.cache.put(key, (
+            time.monotonic() + float(row['remaining']), data))
+        return (True, data and replace(data))
+
+    async def tc_put(
+        self, key: str,
+        data: Optional['stub.SongData'],
+        ttl: Optional[float] = None
+    ) -> None:
+        """Caches the metadata of a track
+
+        Parameters
+        ----------
+        key
+            The track canonical media key
+        data
+            The track `SongData`, or None for caching a failed lookup
+        ttl
+            Seconds to keep it cached (`TrackCache_TTL`, or
+            `TrackCache_NegativeTTL` for failed lookups, by default)
+        """
+
+        if ttl is None:
+            ttl = self.ttl(data)
+        self.cache.put(key, (
+            time.monotonic() + ttl, data and replace(data)))
+
+        async with self.db.connection() as conn:
+            stmt: PreparedStatement = await conn.prepared(
+                self, 'query_put')
+            await stmt.fetch(key, data, ttl)
+
+    def ttl(self, data: Optional['stub.SongData']) -> float:
+        return float(self.client.config[
+            'TrackCache_TTL' if data is not None
+            else 'TrackCache_NegativeTTL'
+        ])
+
+
+    def stub(self, root: dict[str, Any]) -> None:
+        root['ustorage'].update({
+            'tc_get': Callable[
+                [str], tuple[bool, Optional['SongData']]],
+            'tc_put': Callable[
+                [str, Optional['SongData'], Optional[float]], None],
+            'tc_stats': Callable[[], dict[str, int]]
+        })
@@ -1,14 +1,126 @@
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Optional, Any
 import importlib
 import logging
+import asyncio
 import os
 
+from asyncpg.prepared_stmt import PreparedStatement
+from asyncpg.transaction import Transaction
 from asyncpg.pool import Pool, create_pool
 from asyncpg.connection import Connection
 from stub import  MetaClient, MetaModule
 
 
+Statement = PreparedStatement | list[PreparedStatement]
+
+
+class StorageConnection(Connection):
+    """
+    Connection that keeps the prepared `query_*` statements
+    of every UStorage module (see `Module.db_init`)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: dict[str, Statement] = {}
+
+    async def prepared(
+        self, module: MetaModule, name: str
+    ) -> Statement:
+        """Gets a prepared statement of a module
+
+        Parameters
+        ----------
+        module
+            The UStorage module that declares the statement
+        name
+            The statement attribute name (`query_*`)
+
+        Returns
+        -------
+        PreparedStatement | list[PreparedStatement]
+            The statement (or statements, if the module declares
+            a list of them), prepared on this connection
+        """
+
+        key: str = module.identifier + '.' + name
+        stmt: Optional[Statement] = self.statements.get(key)
+        if stmt is None:
+            query: str | list[str] = getattr(module, name)
+            if isinstance(query, list):
+                stmt = [await self.prepare(q) for q in query]
+
+            else:
+                stmt = await self.prepare(query)
+
+            self.statements[key] = stmt
+        return stmt
+
+
+class UnitOfWork:
+    """
+    A connection shared by the storage calls of a task
+
+    The connection is only acquired when it's needed, so units of
+    work that are entirely served from the caches don't touch the
+    pool. Without a transaction it's released as soon as no call
+    (or nested transaction) is using it, so tasks don't keep it
+    while waiting for locks or network I/O.
+    """
+
+    def __init__(self, pool: Pool, transaction: bool = False):
+        self.pool: Pool = pool
+        self.transaction: bool = transaction
+        self.task: Optional[asyncio.Task] = asyncio.current_task()
+
+        self.conn: Optional[StorageConnection] = None
+        self.tx: Optional[Transaction] = None
+        self.users: int = 0
+
+    async def acquire(self) -> StorageConnection:
+        if self.conn is None:
+            self.conn = await self.pool.acquire()
+            if self.transaction:
+                self.tx = self.conn.transaction()
+                await self.tx.start()
+
+        self.users += 1
+        return self.conn
+
+    async def release(self) -> None:
+        self.users -= 1
+        if self.users == 0 and self.tx is None and self.conn is not None:
+            conn: StorageConnection = self.conn
+            self.conn = None
+            await self.pool.release(conn)
+
+    async def close(self, failed: bool = False) -> None:
+        if self.conn is None:
+            return
+
+        try:
+            if self.tx is not None:
+                if failed:
+                    await self.tx.rollback()
+
+                else:
+                    await self.tx.commit()
+
+        finally:
+            await self.pool.release(self.conn)
+            self.conn = None
+            self.tx = None
+
+
+# The unit of work of the current task (asyncpg connections can't
+# be used concurrently, so child tasks don't inherit it)
+current_unit: ContextVar[Optional[UnitOfWork]] = \
+    ContextVar('ustorage_unit', default=None)
+
+
 class Module(MetaModule):
     modules: dict[str, MetaModule]
 
@@ -19,7 +131,8 @@ class Module(MetaModule):
 
     async def install(self) -> None:
         self.client.register_configuration(self, {
-            'Ustorage_Modules': []
+            'Ustorage_Modules': [],
+            'Ustorage_StatementCache': 100
         })
 
         self.modules = {}
@@ -35,12 +148,10 @@ class Module(MetaModule):
 
             self.modules[module.identifier] = module
 
-        self.pool = await create_pool(
-            user=os.getenv('PDB_USER', 'admin'),
-            password=os.getenv('PDB_PAWD', 'admin'),
-            host=os.getenv('PDB_HOST', '127.0.0.1'),
-            port=int(os.getenv('PDB_PORT', '5432')),
-            database=os.getenv('PDB_NAME', 'radiobot'),
+        self.pool = await self.new_pool(
+            statement_cache_size=int(
+                self.client.config['Ustorage_StatementCache']),
+            connection_class=StorageConnection,
             init=self.db_init
         )
 
@@ -55,12 +166,114 @@ class Module(MetaModule):
             if hasattr(mod, 'post_install'):
                 await mod.post_install()
 
+    async def shutdown(self) -> None:
+        for mod in self.modules.values():
+            if hasattr(mod, 'shutdown'):
+                await mod.shutdown()
+
+        if self.pool:
+            await self.pool.close()
+
+    async def new_pool(self, **kwargs) -> Pool:
+        """Creates a connection pool to the bot DB
+
+        Parameters
+        ----------
+        kwargs
+            Extra `asyncpg.create_pool` arguments
+        """
+
+        return await create_pool(
+            user=os.getenv('PDB_USER', 'admin'),
+            password=os.getenv('PDB_PAWD', 'admin'),
+            host=os.getenv('PDB_HOST', '127.0.0.1'),
+            port=int(os.getenv('PDB_PORT', '5432')),
+            database=os.getenv('PDB_NAME', 'radiobot'),
+            **kwargs
+        )
+
+    def current_unit(self) -> Optional[UnitOfWork]:
+        uow: Optional[UnitOfWork] = current_unit.get()
+        if uow and uow.task is asyncio.current_task():
+            return uow
+        return None
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[StorageConnection]:
+        """Gets a connection for running queries
+
+        Notes
+        -----
+        Inside of a unit of work its connection is reused, in any
+        other case one is acquired from the pool (and released
+        when the context manager exits)
+        """
+
+        uow: Optional[UnitOfWork] = self.current_unit()
+        if uow is not None:
+            conn: StorageConnection = await uow.acquire()
+            try:
+                yield conn
+
+            finally:
+                await uow.release()
+            return
+
+        async with self.pool.acquire() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def unit_of_work(
+        self, transaction: bool = False
+    ) -> AsyncIterator[UnitOfWork]:
+        """Shares a single connection between the storage calls
+        made inside of it (by the current task)
+
+        Parameters
+        ----------
+        transaction
+            Run the whole unit of work inside of a transaction
+            (a savepoint, if it's nested on another one)
+
+        Notes
+        -----
+        Only transactions keep the connection for the whole unit of
+        work, in any other case it goes back to the pool between
+        storage calls (see `UnitOfWork`)
+        """
+
+        uow: Optional[UnitOfWork] = self.current_unit()
+        if uow is not None:
+            if transaction:
+                conn: StorageConnection = await uow.acquire()
+                try:
+                    async with conn.transaction():
+                        yield uow
+
+                finally:
+                    await uow.release()
+
+            else:
+                yield uow
+            return
+
+        uow = UnitOfWork(self.pool, transaction)
+        token = current_unit.set(uow)
+        failed: bool = True
+        try:
+            yield uow
+            failed = False
+
+        finally:
+            current_unit.reset(token)
+            await uow.close(failed)
+
     async def test_helper(self, identifier: str) -> Optional[MetaModule]:
         if identifier in self.modules:
             logging.debug('Running test of `%s` module', identifier)
             return self.modules[identifier]
 
-    async def db_init(self, conn: Connection) -> None:
+    async def db_init(self, conn: StorageConnection) -> None:
             for mod in self.modules.values():
                 if hasattr(mod, 'db_init'):
                     try:
@@ -69,13 +282,31 @@ class Module(MetaModule):
                     except Exception:
                         logging.warning(
                             'Can\'t initialize connetion with module'
-                            '`%s` parameters, please check it...')
+                            '`%s` parameters, please check it...', mod.path)
+
+            # Statements are prepared after every codec is set,
+            # as the prepared ones are bound to them
+            for mod in self.modules.values():
+                for name in dir(mod):
+                    if not name.startswith('query_'):
+                        continue
+
+                    try:
+                        await conn.prepared(mod, name)
+
+                    except Exception:
+                        logging.debug(
+                            'Can\'t prepare `%s.%s`, it will be '
+                            'prepared on its first use', mod.path, name)
 
 
     def stub(self, root: dict[str, Any]) -> None:
         root['ustorage'] = {
             '__name__': 'Storage',
-            'pool': Optional[Pool]
+            'pool': Optional[Pool],
+            'new_pool': Callable[..., Pool],
+            'connection': Callable[[], Any],
+            'unit_of_work': Callable[[bool], Any]
         }
 
         root['umodule'] = {
@@ -83,6 +314,7 @@ class Module(MetaModule):
             'install': Callable[[], None],
             'setup': Callable[[], None],
             'post_install': Callable[[], None],
+            'shutdown': Callable[[], None],
             'test': Callable[[], None],
             'stub': Callable[[dict[str, Any]], None],
             'path': str
@@ -21,6 +21,7 @@ class Module(MetaModule):
     i18n: MetaModule
     goodies: MetaModule
     ustorage: MetaModule
+    outbound: MetaModule
 
     close_prefix: str
     handlers: dict[str, MessageHandler | CallbackQueryHandler]
@@ -28,6 +29,8 @@ class Module(MetaModule):
 
     def __init__(self, client: MetaClient) -> None:
         self.identifier: str = 'BaseUI'
+        self.requires: tuple[str, ...] = (
+            'I18n', 'Goodies', 'UStorage', 'Outbound')
         self.client: MetaClient = client
 
     async def setup(self) -> None:
@@ -37,9 +40,9 @@ class Module(MetaModule):
         pass
 
     async def post_install(self) -> None:
-        self.i18n, self.goodies, self.ustorage = \
+        self.i18n, self.goodies, self.ustorage, self.outbound = \
             self.client.require_modules((
-                'I18n', 'Goodies', 'UStorage'))
+                'I18n', 'Goodies', 'UStorage', 'Outbound'))
         self.close_prefix = self.goodies.get_callback_prefix()
 
         common = filters.private
@@ -67,20 +70,26 @@ class Module(MetaModule):
         message: Message,
         context: 'stub.Context'
     ) -> None:
-        await message.reply(self.i18n[context]['base_start'])
+        await self.outbound.call(
+            message.chat.id, self.outbound.Priority.MESSAGE,
+            message.reply, self.i18n[context]['base_start'])
 
     async def help(
         self, _,
         message: Message,
         context: 'stub.Context'
     ) -> None:
-        await message.reply(self.i18n[context]['base_help'])
+        await self.outbound.call(
+            message.chat.id, self.outbound.Priority.MESSAGE,
+            message.reply, self.i18n[context]['base_help'])
 
     async def close(
         self, _,
         query: CallbackQuery
     ) -> None:
-        await query.message.delete()
+        await self.outbound.call(
+            query.message.chat.id, self.outbound.Priority.MESSAGE,
+            query.message.delete)
 
 
     def stub(self, root: dict[str, Any]) -> None:
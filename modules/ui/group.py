@@ -2,8 +2,10 @@
     Group User Interface
 """
 
+from collections.abc import AsyncGenerator
 from typing import Optional
 import traceback
+import tempfile
 
 from pytgcalls.exceptions import NotInCallError, NoActiveGroupCall
 from pytgcalls.pytgcalls import PyTgCalls
@@ -31,6 +33,7 @@ class Module(MetaModule):
     goodies: MetaModule
     playerui: MetaModule
     ustorage: MetaModule
+    outbound: MetaModule
 
     player_status: 'stub.PlayerStatus'
     handlers: dict[str, MessageHandler]
@@ -38,6 +41,9 @@ class Module(MetaModule):
 
     def __init__(self, client: MetaClient):
         self.identifier = 'GroupUI'
+        self.requires: tuple[str, ...] = (
+            'I18n', 'Player', 'Goodies', 'PlayerUI', 'UStorage',
+            'Outbound')
         self.client: MetaClient = client
 
     async def setup(self) -> None:
@@ -47,53 +53,64 @@ class Module(MetaModule):
         pass
 
     async def post_install(self):
-        self.i18n, self.player, self.goodies, self.playerui, self.ustorage = \
-            self.client.require_modules((
-                'I18n', 'Player', 'Goodies', 'PlayerUI', 'UStorage'))
+        self.i18n, self.player, self.goodies, self.playerui, self.ustorage, \
+            self.outbound = self.client.require_modules((
+                'I18n', 'Player', 'Goodies', 'PlayerUI', 'UStorage',
+                'Outbound'))
         self.player_status = self.player.player_status
 
+        # Read-only commands run concurrently, the ones that
+        # change the player are exclusive
+        shared: int = self.ustorage.LockLevel.SHARED
+        exclusive: int = self.ustorage.LockLevel.EXCLUSIVE
+
         common = pyrogram.filters.group
         self.handlers = {
             'play': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.play),
+                    self.ustorage.use_lock(self.play, exclusive),
                     auto_update=False),
                 pyrogram.filters.command('play') & common
             ),
             'pause': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.pause)),
+                    self.ustorage.use_lock(self.pause, exclusive)),
                 pyrogram.filters.command('pause') & common
             ),
             'resume': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.resume)),
+                    self.ustorage.use_lock(self.resume, exclusive)),
                 pyrogram.filters.command('resume') & common
             ),
             'next': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.next)),
+                    self.ustorage.use_lock(self.next, exclusive)),
                 pyrogram.filters.command('next') & common
             ),
             'volume': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.volume)),
+                    self.ustorage.use_lock(self.volume, exclusive)),
                 pyrogram.filters.command('volume') & common
             ),
             'stop': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.stop)),
+                    self.ustorage.use_lock(self.stop, exclusive)),
                 pyrogram.filters.command('stop') & common
             ),
             'status': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.status)),
+                    self.ustorage.use_lock(self.status, shared)),
                 pyrogram.filters.command('status') & common
             ),
             'playlist': MessageHandler(
                 self.ustorage.c11e(
-                    self.ustorage.use_lock(self.playlist)),
+                    self.ustorage.use_lock(self.playlist, shared)),
                 pyrogram.filters.command('playlist') & common
+            ),
+            'export': MessageHandler(
+                self.ustorage.c11e(
+                    self.ustorage.use_lock(self.export, shared)),
+                pyrogram.filters.command('export') & common
             )
         }
 
@@ -125,11 +142,28 @@ class Module(MetaModule):
         await self.goodies.update_status(
             context, self.i18n[context]['gpl_fetchingsd'])
 
-        sdata: 'stub.SongData' = await self.goodies.song_from_url(url)
-        sdata.url = url
+        # The first song is played right away, and the rest of
+        # them (if it's a playlist) are enqueued in the background
+        songs: AsyncGenerator['stub.SongData', None] = \
+            self.goodies.songs_from_url(url)
+
+        sdata: 'stub.SongData'
+        try:
+            sdata = await anext(songs)
+
+        except self.goodies.MetadataUnavailable:
+            await self.goodies.update_status(
+                context, self.i18n[context]['gpl_unavailable'])
+            return
 
         status: 'stub.PlayerStatus' = self.player_status
         async for upd in self.player.play(context, sdata):
+            if upd in (status.ENQUEUED, status.OK):
+                self.player.enqueue_stream(context, songs)
+
+            elif upd not in (status.GENERATING_CHAT_LINK, status.JOINING):
+                await songs.aclose()
+
             match upd:
                 case status.ENQUEUED:
                     await self.goodies.update_status(
@@ -314,22 +348,59 @@ class Module(MetaModule):
             )
         )
 
+    async def export(
+        self, _, message: Message, context: 'stub.Context'
+    ) -> Optional[bool]:
+        if not context.voice_id:
+            await self.goodies.update_status(
+                context, self.i18n[context]['pl_novoice'])
+            return False
+
+        pos: Optional[int] = await self.ustorage.pl_position(
+            context.voice_id)
+
+        if not pos:
+            await self.goodies.update_status(
+                context, self.i18n[context]['gpl_nonext'])
+            return
+
+        # Streamed to a temporary file (from the song that is
+        # being played), so the playlist isn't kept in memory
+        songs: int = 0
+        with tempfile.TemporaryFile() as export:
+            async for line in self.ustorage.pl_export(
+                    context.voice_id, pos - 1):
+                export.write(line)
+                songs += 1
+
+            export.seek(0)
+            await self.outbound.call(
+                message.chat.id, self.outbound.Priority.MESSAGE,
+                message.reply_document,
+                export, file_name=f'playlist_{context.voice_id}.jsonl',
+                caption=self.i18n[context]['gpl_exported'].format(songs))
+
     # TODO: Isolate on its own module
     async def api_next(
         self, _: PyTgCalls, update: Update
     ) -> None:
-        context: 'stub.Context' = await self.ustorage \
-            .ctx_get_by_voice(update.chat_id)
-        await self.ustorage.acquire_lock(context)
-
-        if not context:
-            try:
-                await self.player.api.leave_chat(update.chat_id)
-
-            except (NotInCallError, NoActiveGroupCall):
-                pass
+        self.player.stream_ended(update.chat_id)
+        async with self.ustorage.unit_of_work():
+            context: 'stub.Context' = await self.ustorage \
+                .ctx_get_by_voice(update.chat_id)
+            if not context:
+                try:
+                    await self.player.api.leave_chat(update.chat_id)
+
+                except (NotInCallError, NoActiveGroupCall):
+                    pass
+                return
+
+            # Stream ends can't be dropped (the next song would never
+            # be played), so they wait for as long as the lock is held
+            lock_id: int = await self.ustorage.acquire_lock(
+                context, owner='api_next', timeout=None)
 
-        else:
             try:
                 status: 'stub.PlayerStatus' = self.player_status
                 match await self.player.next(context):
@@ -353,7 +424,8 @@ class Module(MetaModule):
                     context, e, traceback.format_exc(),
                     '[unexpected exception, player.next/playerui.player_init]')
 
-        await self.ustorage.unlock_chat(context)
+            finally:
+                await self.ustorage.unlock_chat(context, lock_id)
 
 
     def stub(self, root: dict[str, any]) -> None:
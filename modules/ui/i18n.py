@@ -2,15 +2,86 @@
     Internacionalization (i18n)
 """
 
-from typing import Any
+from typing import Optional, Any
+from string import Formatter
+import logging
+import asyncio
 import json
+import os
 
 from stub import MetaClient, MetaModule
 
 
+def template_fields(template: str) -> Optional[set[str]]:
+    try:
+        return {
+            x[1] for x in Formatter().parse(template)
+            if x[1] is not None
+        }
+
+    except ValueError:
+        return None
+
+
+class Catalog(dict[str, str]):
+    """
+    Resolved strings of a language
+
+    The strings missing on the language are taken from the
+    default one, and its templates are checked once, when the
+    catalog is compiled (translated templates with placeholders
+    unknown to the default language ones are replaced by them).
+    They're still rendered by `str.format`, as its C parser is
+    faster than rendering pre-parsed templates in Python.
+    """
+
+    def __init__(
+        self, code: str, strings: dict[str, str],
+        base: Optional['Catalog'] = None
+    ):
+        super().__init__(base or {})
+        self.code: str = code
+
+        # Set when the catalog is replaced (see `Module.compile`)
+        self.stale: bool = False
+
+        for key, template in strings.items():
+            if base is not None and key in base:
+                # Unparsable default strings have no valid fields
+                fields: Optional[set[str]] = template_fields(template)
+                if fields is None or \
+                        not fields <= (template_fields(base[key]) or set()):
+                    logging.warning(
+                        'Invalid `%s` string on `%s`, using the default '
+                        'language one', key, code)
+                    continue
+
+            self[key] = template
+
+    def format(self, key: str, /, *args, **kwargs) -> str:
+        return self[key].format(*args, **kwargs)
+
+
+def normalize_code(lang_code: Optional[str]) -> str:
+    """Normalizes a language code (`pt_BR` -> `pt-br`)"""
+
+    return (lang_code or '').strip().replace('_', '-').lower()
+
+
 class Module(MetaModule):
     """
     Internacionalization module
+
+    Languages are compiled into `Catalog`s, and every context
+    keeps a reference to the one of its language (so the
+    lookups made by handlers don't resolve it again).
+
+    Language codes are resolved to the best catalog (the exact
+    one, then the base language one, then the default one), and
+    the result is memoized by code.
+
+    With `i18n_HotReload` enabled, the strings & consts files are
+    polled for changes and reloaded without restarting the bot.
     """
 
     def __init__(self, client: MetaClient) -> None:
@@ -21,6 +92,11 @@ class Module(MetaModule):
 
         self.strings: dict[str, dict[str, str]] = {}
         self.consts: dict[str, dict[str, str]] = {}
+        self.catalogs: dict[str, Catalog] = {}
+
+        # Language code (as it comes) -> resolved catalog
+        self.resolved: dict[Optional[str], Catalog] = {}
+        self.watcher: Optional[asyncio.Task] = None
 
     async def setup(self) -> None:
         pass
@@ -28,11 +104,20 @@ class Module(MetaModule):
     async def install(self) -> None:
         self.client.register_configuration(self, {
             'i18n_strings': 'strings.json',
-            'i18n_consts': 'consts.json'
+            'i18n_consts': 'consts.json',
+            'i18n_ResolvedCodes': 1024,
+            'i18n_HotReload': False,
+            'i18n_ReloadInterval': 2
         })
 
     async def post_install(self) -> None:
         self.update_strings(True)
+        if self.client.config['i18n_HotReload']:
+            self.watcher = asyncio.create_task(self.watch_routine())
+
+    async def shutdown(self) -> None:
+        if self.watcher:
+            self.watcher.cancel()
 
 
     def update_strings(self, clean_update: bool = False) -> None:
@@ -41,36 +126,165 @@ class Module(MetaModule):
         file
         """
 
+        self.swap(*self.build(*self.load(), clean_update))
+
+    def load(
+        self
+    ) -> tuple[str, dict[str, dict[str, str]], dict[str, str]]:
+        """Reads & parses the strings and consts files
+
+        Returns
+        -------
+        tuple
+            The default language code, the strings of every
+            language and the consts
+        """
+
         with open(
             self.client.config['i18n_strings'],
             encoding='utf-8'
         ) as i18n:
-            temp: dict[str, dict[str, str]] = json.load(i18n)
-            self.default = next(iter(temp))
+            strings: dict[str, dict[str, str]] = json.load(i18n)
 
-            if not clean_update:
-                self.strings.update(temp)
+        # The default language is either set by the `default`
+        # key, or it's the first one
+        default: Any = strings.pop('default', None)
+        if not isinstance(default, str):
+            default = next(iter(strings))
 
-            else:
-                self.strings = temp
-            
         with open(
             self.client.config['i18n_consts'],
             encoding='utf-8'
         ) as consts:
-            temp: dict[str, dict[str, str]] = json.load(consts)
-            if not clean_update:
-                self.consts.update(temp)
-            
-            else:
-                self.consts = temp
+            return (default, strings, json.load(consts))
 
-    def __getitem__(self, key: object) -> dict[str, str]:
-        if hasattr(key, 'lang_code'):
-            return self.strings.get(
-                key.lang_code, self.strings[self.default])
+    def build(
+        self, default: str,
+        strings: dict[str, dict[str, str]],
+        consts: dict[str, str],
+        clean_update: bool = False
+    ) -> tuple[
+        str, dict[str, dict[str, str]],
+        dict[str, str], dict[str, Catalog]
+    ]:
+        """Merges (unless `clean_update`) & compiles the loaded
+        strings, without touching the ones in use
 
-        return self.strings[self.default]
+        Returns
+        -------
+        tuple
+            The `swap` arguments
+        """
+
+        if not clean_update:
+            strings = self.strings | strings
+            consts = self.consts | consts
+        return (default, strings, consts, self.compile(default, strings))
+
+    def swap(
+        self, default: str,
+        strings: dict[str, dict[str, str]],
+        consts: dict[str, str],
+        catalogs: dict[str, Catalog]
+    ) -> None:
+        # Nothing is awaited in here, so handlers see either the
+        # old strings or the new ones
+        old: dict[str, Catalog] = self.catalogs
+        self.default = default
+        self.strings = strings
+        self.consts = consts
+        self.catalogs = catalogs
+        self.resolved = {}
+        for catalog in old.values():
+            catalog.stale = True
+
+    def compile(
+        self, default: str,
+        strings: dict[str, dict[str, str]]
+    ) -> dict[str, Catalog]:
+        """Compiles the catalogs of every language
+
+        Returns
+        -------
+        dict
+            The catalogs by normalized language code
+        """
+
+        base: Catalog = Catalog(default, strings[default])
+        catalogs: dict[str, Catalog] = {normalize_code(default): base}
+        for code, lang in strings.items():
+            if code != default:
+                catalogs[normalize_code(code)] = Catalog(code, lang, base)
+        return catalogs
+
+    def mtimes(self) -> tuple[int, ...]:
+        out: list[int] = []
+        for key in ('i18n_strings', 'i18n_consts'):
+            try:
+                out.append(os.stat(self.client.config[key]).st_mtime_ns)
+
+            except OSError:
+                out.append(-1)
+        return tuple(out)
+
+    async def watch_routine(self) -> None:
+        last: tuple[int, ...] = await asyncio.to_thread(self.mtimes)
+        while True:
+            await asyncio.sleep(self.client.config['i18n_ReloadInterval'])
+
+            current: tuple[int, ...] = await asyncio.to_thread(self.mtimes)
+            if current == last:
+                continue
+            last = current
+
+            # Files are parsed & compiled off of the event loop (only
+            # the references are swapped on it), the old catalogs are
+            # kept if they're broken
+            try:
+                data: tuple = await asyncio.to_thread(
+                    lambda: self.build(*self.load(), True))
+                self.swap(*data)
+
+            except Exception:
+                logging.exception(
+                    'Can\'t reload the i18n strings, keeping the old ones')
+                continue
+
+            logging.info('Reloaded the i18n strings')
+
+    def catalog(self, lang_code: Optional[str]) -> Catalog:
+        """Gets the catalog of a language code
+
+        Notes
+        -----
+        Codes are resolved once (`pt-BR` -> `pt-br`, `pt` or the
+        default language), further lookups are a dict access
+        """
+
+        catalog: Optional[Catalog] = self.resolved.get(lang_code)
+        if catalog is not None:
+            return catalog
+
+        code: str = normalize_code(lang_code)
+        catalog = self.catalogs.get(code) or \
+            self.catalogs.get(code.split('-', 1)[0]) or \
+            self.catalogs[normalize_code(self.default)]
+
+        # Codes come from users, so the memo is kept bounded
+        if len(self.resolved) >= self.client.config['i18n_ResolvedCodes']:
+            self.resolved.clear()
+
+        self.resolved[lang_code] = catalog
+        return catalog
+
+    def __getitem__(self, key: object) -> Catalog:
+        catalog: Optional[Catalog] = getattr(key, 'catalog', None)
+        if catalog is None or catalog.stale:
+            catalog = self.catalog(getattr(key, 'lang_code', None))
+            if hasattr(key, 'catalog'):
+                key.catalog = catalog
+
+        return catalog
 
     def stub(self, root: dict[str, Any]) -> None:
-        pass
\ No newline at end of file
+        pass
@@ -20,6 +20,7 @@ class Module(MetaModule):
     player: MetaModule
     goodies: MetaModule
     ustorage: MetaModule
+    outbound: MetaModule
 
     buttons: dict[str, str]
     handlers: dict[str, CallbackQueryHandler]
@@ -27,15 +28,19 @@ class Module(MetaModule):
 
     def __init__(self, client: MetaClient):
         self.identifier: str = 'PlayerUI'
+        self.requires: tuple[str, ...] = (
+            'I18n', 'BaseUI', 'Player', 'Goodies', 'UStorage',
+            'Outbound')
         self.client: MetaClient= client
 
     async def setup(self) -> None:
         pass
 
     async def install(self) -> None:
-        self.i18n, self.baseui, self.player, self.goodies, self.ustorage = \
-            self.client.require_modules((
-                'I18n', 'BaseUI', 'Player', 'Goodies', 'UStorage'))
+        self.i18n, self.baseui, self.player, self.goodies, self.ustorage, \
+            self.outbound = self.client.require_modules((
+                'I18n', 'BaseUI', 'Player', 'Goodies', 'UStorage',
+                'Outbound'))
 
         self.buttons = {
             'reload': self.goodies.get_callback_prefix(),
@@ -118,14 +123,17 @@ class Module(MetaModule):
             ), reply_markup=kbd
         )
 
+    async def answer(self, query: CallbackQuery, text: str) -> None:
+        await self.outbound.call(
+            None, self.outbound.Priority.ANSWER, query.answer, text)
+
     async def reload(
         self, _: Client,
         query: CallbackQuery,
         context: 'stub.Context'
     ) -> None:
         await self.player_init(context)
-        await query.answer(
-            self.i18n[context]['cpl_updated'])
+        await self.answer(query, self.i18n[context]['cpl_updated'])
 
     async def toggle(
         self, _: Client,
@@ -137,17 +145,16 @@ class Module(MetaModule):
             call = (await self.player.api.group_calls)[context.voice_id]
 
         except NotInCallError:
-            await query.answer(
-                self.i18n[context]['cpl_unknownerr'])
+            await self.answer(query, self.i18n[context]['cpl_unknownerr'])
             return
 
         if call.status == Call.Status.PLAYING:
             await self.player.pause(context)
-            await query.answer(self.i18n[context]['cpl_paused'])
+            await self.answer(query, self.i18n[context]['cpl_paused'])
         
         else:
             await self.player.resume(context)
-            await query.answer(self.i18n[context]['cpl_resumed'])
+            await self.answer(query, self.i18n[context]['cpl_resumed'])
         await self.player_init(context)
 
     async def next(
@@ -155,7 +162,7 @@ class Module(MetaModule):
         query: CallbackQuery,
         context: 'stub.Context'
     ) -> None:
-        await query.answer('Not implemented')
+        await self.answer(query, 'Not implemented')
 
     async def stop(
         self, _: Client,
@@ -163,7 +170,7 @@ class Module(MetaModule):
         context: 'stub.Context'
     ) -> None:
         await self.player.stop(context)
-        await query.answer(self.i18n[context]['cpl_ended'])
+        await self.answer(query, self.i18n[context]['cpl_ended'])
         await self.goodies.update_status(
             context, self.i18n[context]['gpl_ended'],
             reply_markup=None
@@ -14,6 +14,10 @@ class MetaModule(metaclass=ABCMeta):
     identifier: str
     client: 'MetaClient'
 
+    # Identifiers of the modules whose `install`/`post_install`
+    # must run before the ones of this module
+    requires: tuple[str, ...] = ()
+
     @abstractmethod
     async def setup(self) -> None:
         """
@@ -0,0 +1,89 @@
+"""
+    Context lookup benchmark
+
+    Measures `ctx_get_by_aid`/`ctx_get_by_logid` DB lookup latency
+    with 10k, 100k and 1M stored contexts (the cache is bypassed).
+    It isn't part of the default test run, add it to `tests` on
+    settings.json for running it.
+"""
+
+from typing import Optional, Any
+import logging
+import time
+
+from asyncpg import Record
+from stub import MetaModule
+
+
+sizes: tuple[int, ...] = (10_000, 100_000, 1_000_000)
+lookups: int = 1000
+
+# The lookup that was used before the expression index was added
+query_or: str = '''
+    SELECT voice_id, context::Telegram.ContextObj FROM Telegram.Context
+    WHERE (context).log_id = $1 OR voice_id = $1
+    LIMIT 1
+'''
+
+
+async def time_lookups(
+    conn: Any, query: str, keys: list[int]
+) -> float:
+    start: float = time.perf_counter()
+    for key in keys:
+        row: Optional[Record] = await conn.fetchrow(query, key)
+        assert row is not None
+    return (time.perf_counter() - start) / len(keys) * 1000
+
+
+async def bench_post_install(self: MetaModule) -> Optional[Exception]:
+    mod: MetaModule = await self.test_helper('Context')
+    if not mod:
+        return
+
+    async with self.pool.acquire() as conn:
+        filled: int = 0
+        for size in sizes:
+            logging.info('Filling `Telegram.Context` up to %d rows', size)
+            await conn.execute('''
+                INSERT INTO Telegram.Context
+                SELECT g, ROW(-g, true, 'en', -1)::Telegram.ContextObj
+                FROM generate_series($1, $2) AS g
+            ''', filled + 1, size)
+            await conn.execute('ANALYZE Telegram.Context')
+            filled = size
+
+            rows: list[Record] = await conn.fetch('''
+                SELECT voice_id, (context).log_id AS log_id
+                FROM Telegram.Context
+                ORDER BY random()
+                LIMIT $1
+            ''', lookups)
+
+            voice_ids: list[int] = [r['voice_id'] for r in rows]
+            log_ids: list[int] = [r['log_id'] for r in rows]
+
+            results: dict[str, float] = {
+                'byaid[voice]': await time_lookups(
+                    conn, mod.query_byaid, voice_ids),
+                'byaid[log]': await time_lookups(
+                    conn, mod.query_byaid, log_ids),
+                'bylogid': await time_lookups(
+                    conn, mod.query_bylogid, log_ids),
+                'or[voice]': await time_lookups(
+                    conn, query_or, voice_ids[:max(1, lookups // 10)]),
+                'or[log]': await time_lookups(
+                    conn, query_or, log_ids[:max(1, lookups // 10)])
+            }
+
+            for k, v in results.items():
+                logging.info(
+                    'Results `%s` with %d contexts: %fms', k, size, v)
+
+        await conn.execute('DELETE FROM Telegram.Context')
+
+
+test_module: str = 'UStorage'
+steps: dict[str, Optional[callable]] = {
+    'post_install': bench_post_install
+}
@@ -0,0 +1,89 @@
+"""
+    I18n rendering microbenchmark
+
+    Measures the player status rendering (`Goodies.format_sd`)
+    through the compiled catalogs, against the lookups that were
+    made before them. It isn't part of the default test run, add
+    it to `tests` on settings.json for running it.
+"""
+
+from typing import Optional
+import logging
+import time
+
+from stub import MetaModule
+import stub
+
+
+renders: int = 100_000
+
+
+def legacy_format_sd(
+    self: MetaModule, goodies: MetaModule,
+    context: 'stub.Context', data: 'stub.SongData',
+    elapsed: Optional[int] = None, key: str = 'gd_sdata'
+) -> str:
+    # What `format_sd` did before the catalogs were compiled
+    def lookup(key: object) -> dict[str, str]:
+        if hasattr(key, 'lang_code'):
+            return self.strings.get(
+                key.lang_code, self.strings[self.default])
+        return self.strings[self.default]
+
+    return lookup(context)[key].format(
+        author=data.author or lookup(context)['gd_noauthor'],
+        title=data.title or lookup(context)['gd_notitle'],
+        album=data.album or lookup(context)['gd_noalbum'],
+        genre=data.genre or lookup(context)['gd_nogenre'],
+        year=data.year or lookup(context)['gd_noyear'],
+        url=data.url,
+        lyricist=data.lyricist or lookup(context)['gd_nolcst'],
+        elapsed=(
+            goodies.format_duration(elapsed) if elapsed is not None
+            else None
+        ) or '?',
+        duration=(
+            goodies.format_duration(data.duration)
+                if data.duration is not None
+            else None
+        ) or '?',
+    )
+
+
+async def bench_post_install(self: MetaModule) -> Optional[Exception]:
+    goodies: MetaModule = self.client.modules['Goodies']
+    ustorage: MetaModule = self.client.modules['UStorage']
+
+    data: 'stub.SongData' = ustorage.SongData(
+        author='Author', title='', album='', genre='', year=0,
+        lyricist='', duration=215, url='https://example.com')
+
+    contexts: list['stub.Context'] = [
+        ustorage.Context(voice_id=x, log_id=x, lang_code=code)
+        for x, code in enumerate(
+            (list(self.strings) + ['xx']) * 64)
+    ]
+
+    for context in contexts:
+        assert goodies.format_sd(context, data, 42) == \
+            legacy_format_sd(self, goodies, context, data, 42)
+
+    results: dict[str, float] = {}
+    for name, render in (
+        ('legacy', lambda c: legacy_format_sd(
+            self, goodies, c, data, 42)),
+        ('catalog', lambda c: goodies.format_sd(c, data, 42))
+    ):
+        start: float = time.perf_counter()
+        for x in range(0, renders):
+            render(contexts[x % len(contexts)])
+        results[name] = (time.perf_counter() - start) / renders * 1e6
+
+    for k, v in results.items():
+        logging.info('Results `%s`: %fus per render', k, v)
+
+
+test_module: str = 'I18n'
+steps: dict[str, Optional[callable]] = {
+    'post_install': bench_post_install
+}
@@ -60,6 +60,62 @@ async def routine(
     return time.time() - start
 
 
+async def write_behind(self: MetaModule, mod: MetaModule) -> None:
+    """Checks when written behind updates reach the DB"""
+
+    async def stored_status(voice_id: int) -> Optional[int]:
+        async with self.connection() as conn:
+            return await conn.fetchval(
+                'SELECT (context).status_id FROM Telegram.Context '
+                'WHERE voice_id = $1', voice_id)
+
+    # No periodic flushes during the test, only explicit ones
+    config: dict[str, Any] = self.client.config
+    saved: dict[str, Any] = {
+        k: config[k] for k in ('CtxSt_WriteBehind', 'CtxSt_FlushInterval')}
+    config['CtxSt_WriteBehind'] = True
+    config['CtxSt_FlushInterval'] = 3600 * 1000
+
+    flush_task: Optional[asyncio.Task] = mod.flush_task
+    mod.flush_task = asyncio.create_task(mod.flusher())
+    try:
+        voice_id: int = randint(1, 2 << 30)
+        log_id: int = voice_id + randint(1, 2 << 30)
+        context: 'stub.Context' = await mod.ctx_new(
+            voice_id, True, log_id, 'en', 1)
+        assert await stored_status(voice_id) is None
+
+        # Pending contexts are found by both of their ids
+        mod.cache.clear()
+        mod.logids.clear()
+        assert await mod.ctx_get_by_voice(voice_id) == context
+        assert await mod.ctx_get_by_logid(log_id) == context
+        assert await mod.ctx_get_by_aid(log_id) == context
+
+        await mod.ctx_flush()
+        assert await stored_status(voice_id) == 1
+
+        # Synchronous updates skip the queue
+        context.status_id = 2
+        await mod.ctx_upd(context, sync=True)
+        assert await stored_status(voice_id) == 2
+
+        # Pending updates are flushed on shutdown
+        context.status_id = 3
+        await mod.ctx_upd(context)
+        assert await stored_status(voice_id) == 2
+        await mod.shutdown()
+        assert await stored_status(voice_id) == 3
+
+        await mod.ctx_delete(context)
+
+    finally:
+        if mod.flush_task:
+            mod.flush_task.cancel()
+        mod.flush_task = flush_task
+        config.update(saved)
+
+
 async def test_post_install(self: MetaModule) -> Optional[Exception]:
     """
     Called after post_install
@@ -129,6 +185,7 @@ async def test_post_install(self: MetaModule) -> Optional[Exception]:
 
         perf, ctx = await time_coroutine(mod.ctx_get_by_voice(x.voice_id))
         assert ctx == x
+        assert not ctx.dirty_fields()
         results['ctx_get_by_voice'] += perf
 
         perf, ctx = await time_coroutine(mod.ctx_get_by_logid(x.log_id))
@@ -163,6 +220,11 @@ async def test_post_install(self: MetaModule) -> Optional[Exception]:
         assert ctx is None
         results['ctx_get_by_voice'] += perf
 
+    stats: dict[str, int] = self.ctx_cache_stats()
+    logging.debug('Context cache stats: %s', stats)
+    assert stats['hits'] >= 4 * size
+    assert stats['size'] == 0
+
     results['ctx_upd'] /= 2
     results['ctx_get_by_aid'] /= 2
     results['ctx_get_by_voice'] /= 2
@@ -202,6 +264,9 @@ async def test_post_install(self: MetaModule) -> Optional[Exception]:
         'Concurrency test ran in `%lf seconds` correctly! '
         '(accuracy: %lf%%)', elapsed, runtime / elapsed * 100)
 
+    await write_behind(self, mod)
+    logging.info('Write behind test ran correctly')
+
 
 test_module: str = 'UStorage'
 steps: dict[str, Optional[callable]] = {
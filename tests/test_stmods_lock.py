@@ -0,0 +1,208 @@
+from typing import Optional, Any
+from random import randint
+import logging
+import asyncio
+import time
+import gc
+
+from stub import MetaModule
+import stub
+
+
+async def multi_process(self: MetaModule, mod: MetaModule) -> None:
+    """
+    Runs the DB locks (leases, takeovers & fencing) on a temporary
+    lock pool, with another "process" played by a second pool
+    """
+
+    config: dict[str, Any] = self.client.config
+    ttl: Any = config['LockSt_LeaseTTL']
+    config['LockSt_LeaseTTL'] = 0.6
+
+    pool: Any = mod.pool
+    if pool is None:
+        mod.pool = await self.new_pool(min_size=1, max_size=4)
+    others: Any = await self.new_pool(min_size=1, max_size=2)
+
+    voice_id: int = randint(1, 2 << 30)
+    ctx: 'stub.Context' = self.Context(voice_id=voice_id)
+    try:
+        # Locks held by other processes can't be acquired
+        async with others.acquire() as conn:
+            await conn.fetchval('SELECT pg_advisory_lock($1);', voice_id)
+            assert await mod.lock_chat(ctx) is None
+            assert await mod.lock_chat(ctx, timeout=0.2) is None
+            await conn.fetchval('SELECT pg_advisory_unlock($1);', voice_id)
+
+        # Tokens grow, and leases are renewed while they're held
+        first: int = await self.acquire_lock(ctx)
+        await asyncio.sleep(config['LockSt_LeaseTTL'] * 2)
+        async with self.fenced(voice_id):
+            await self.pl_clean(voice_id)
+
+        # Writes made under a lease that was taken over are rejected
+        async with self.connection() as conn:
+            await conn.execute(
+                'UPDATE Telegram.ChatLease SET token = token + 1 '
+                'WHERE voice_id = $1;', voice_id)
+
+        try:
+            await self.pl_clean(voice_id)
+            raise AssertionError('Stale lock wasn\'t fenced')
+
+        except self.StaleLock:
+            pass
+
+        await self.unlock_chat(ctx, first)
+        second: int = await self.acquire_lock(ctx)
+        assert second > first
+
+        # Stuck holders (expired lease) are disconnected by waiters,
+        # and their heartbeat finds out that the lease was lost
+        held: Any = mod.held[voice_id][second]
+        held.heartbeat.cancel()
+        async with self.connection() as conn:
+            await conn.execute(
+                'UPDATE Telegram.ChatLease SET expires = now() '
+                'WHERE voice_id = $1;', voice_id)
+
+        async with others.acquire() as conn:
+            assert await conn.fetchval(mod.query_reap, voice_id)
+
+        await asyncio.sleep(0.2)
+        await mod.heartbeat_routine(voice_id, held)
+        assert held.lost
+
+        try:
+            async with self.fenced(voice_id, second):
+                pass
+            raise AssertionError('Lost lease wasn\'t fenced')
+
+        except self.StaleLock:
+            pass
+
+        await self.unlock_chat(ctx, second)
+
+        # Waiters disconnect the holders whose lease expired
+        stuck: Any = await others.acquire()
+        try:
+            await stuck.fetchval('SELECT pg_advisory_lock($1);', voice_id)
+            await stuck.execute(
+                'UPDATE Telegram.ChatLease SET pid = pg_backend_pid(), '
+                'expires = now() WHERE voice_id = $1;', voice_id)
+
+            third: int = await self.acquire_lock(ctx)
+            await asyncio.sleep(0.1)
+            assert stuck.is_closed()
+            assert mod.lock_stats(voice_id)['takeovers'] == 1
+            await self.unlock_chat(ctx, third)
+
+        finally:
+            await others.release(stuck)
+
+    finally:
+        await others.close()
+        if pool is None:
+            await mod.pool.close()
+            mod.pool = None
+        config['LockSt_LeaseTTL'] = ttl
+
+
+async def test_post_install(self: MetaModule) -> Optional[Exception]:
+    """
+    Called after post_install
+
+    Arguments
+    ---------
+    self
+        The module to be tested
+
+    Returns
+    -------
+    Exception, optional
+        None if everything went well, in the other case
+        it must return an exception
+    """
+
+    mod: MetaModule = await self.test_helper('Lock')
+    if not mod:
+        return
+
+    voice_id: int = randint(1, 2 << 30)
+    ctx: 'stub.Context' = self.Context(voice_id=voice_id)
+
+    start: float = time.perf_counter()
+    lock_id: int = await self.acquire_lock(ctx)
+    elapsed: float = time.perf_counter() - start
+    assert await self.lock_time(ctx) is not None
+
+    # Taken locks can't be acquired (nor waited for too long)
+    other: 'stub.Context' = self.Context(voice_id=voice_id)
+    assert await mod.lock_chat(other) is None
+    assert await mod.lock_chat(other, timeout=0.2) is None
+
+    # Waiters get the lock as soon as it's released
+    waiter: asyncio.Task = asyncio.create_task(self.acquire_lock(other))
+    await asyncio.sleep(0.2)
+    assert not waiter.done()
+
+    await self.unlock_chat(ctx, lock_id)
+    await self.unlock_chat(other, await asyncio.wait_for(waiter, 5))
+    assert await self.lock_time(ctx) is None
+
+    # Lock ids (fencing tokens) only grow, and the writes of
+    # the current holder go through
+    first: int = await self.acquire_lock(ctx)
+    async with self.fenced(voice_id):
+        await self.pl_clean(voice_id)
+
+    await self.unlock_chat(ctx, first)
+    second: int = await self.acquire_lock(ctx)
+    assert second > first
+    await self.unlock_chat(ctx, second)
+
+    # Handlers run while holding the lock, and release it after
+    async def handler(_, __, context: 'stub.Context') -> bool:
+        return await mod.lock_chat(other) is None
+
+    assert await self.use_lock(handler)(None, None, ctx)
+    assert await mod.lock_chat(other) is not None
+    await self.unlock_chat(other)
+
+    # Shared locks are held together, but not with exclusive ones
+    shared: int = self.LockLevel.SHARED
+    readers: list[int] = [
+        await mod.lock_chat(ctx, shared) for _ in range(0, 3)]
+    assert None not in readers
+    assert await mod.lock_chat(other) is None
+
+    # Waiting writers block new readers
+    writer: asyncio.Task = asyncio.create_task(self.acquire_lock(other))
+    await asyncio.sleep(0.1)
+    assert await mod.lock_chat(ctx, shared) is None
+
+    for reader in readers:
+        await self.unlock_chat(ctx, reader)
+    await self.unlock_chat(other, await asyncio.wait_for(writer, 5))
+
+    # Idle chats don't keep their in-process lock
+    gc.collect()
+    assert voice_id not in mod.local
+
+    # Every acquisition (and failed one) got recorded
+    stats: dict = self.lock_stats(voice_id)
+    assert stats['busy'] and stats['timeouts']
+    assert stats['wait']['count'] == stats['hold']['count']
+    assert self.lock_stats(owner='handler')['hold']['count'] == 1
+    assert voice_id in dict(self.lock_ranking('wait', 'chat', 1 << 20))
+
+    await multi_process(self, mod)
+
+    logging.info('Lock test ran correctly (acquired in %fms)',
+        elapsed * 1000)
+
+
+test_module: str = 'UStorage'
+steps: dict[str, Optional[callable]] = {
+    'post_install': test_post_install
+}
@@ -0,0 +1,123 @@
+from typing import Optional
+from random import randint
+import logging
+import asyncio
+import time
+
+from stub import MetaModule
+import stub
+
+
+async def test_post_install(self: MetaModule) -> Optional[Exception]:
+    """
+    Called after post_install
+
+    Arguments
+    ---------
+    self
+        The module to be tested
+
+    Returns
+    -------
+    Exception, optional
+        None if everything went well, in the other case
+        it must return an exception
+    """
+
+    mod: MetaModule = await self.test_helper('Playlist')
+    if not mod:
+        return
+
+    def make(no: int) -> 'stub.SongData':
+        return self.SongData(
+            author=f'Author {no}', title=f'Title {no}',
+            album='', genre='', year=2000 + no % 25,
+            lyricist='', duration=no,
+            url=f'https://example.com/{no}')
+
+    voice_id: int = randint(1, 2 << 30)
+    size: int = randint(20, 50)
+
+    # Concurrent enqueues must not lose any song, nor repeat any id
+    await asyncio.gather(*[
+        mod.pl_enqueue(voice_id, make(x)) for x in range(0, size)])
+    assert await mod.pl_size(voice_id) == size
+    assert await mod.pl_position(voice_id) == 0
+
+    await mod.pl_enqueue_many(
+        voice_id, [make(x) for x in range(size, 2 * size)])
+    assert await mod.pl_size(voice_id) == 2 * size
+
+    # Keyset pagination goes through the whole playlist in order
+    cursor: int = -1
+    fetched: list[int] = []
+    while True:
+        page: list[tuple[int, 'stub.SongData']] = \
+            await mod.pl_fetch_page(voice_id, cursor, 7)
+        if not page:
+            break
+
+        fetched.extend(x[0] for x in page)
+        cursor = page[-1][0]
+
+    assert fetched == list(range(0, 2 * size))
+    assert await mod.pl_fetch(voice_id, limit=1, offset=size) == \
+        [make(size)]
+
+    durations: set[int] = set()
+    for x in range(0, 2 * size):
+        data: Optional[tuple[int, 'stub.SongData']] = \
+            await mod.pl_dequeue(voice_id)
+
+        assert data is not None
+        assert data[0] == x
+        durations.add(data[1].duration)
+
+        # Songs enqueued in bulk keep their order
+        if x >= size:
+            assert data[1] == make(x)
+
+    assert durations == set(range(0, 2 * size))
+    assert await mod.pl_dequeue(voice_id) is None
+
+    await mod.pl_clean(voice_id)
+    assert await mod.pl_size(voice_id) is None
+
+    # Bulk import (appended after the already enqueued songs)
+    imported: int = randint(2000, 5000)
+    await mod.pl_enqueue(voice_id, make(0))
+    start: float = time.perf_counter()
+    assert await mod.pl_import(
+        voice_id, (make(x) for x in range(1, imported + 1))) == imported
+    elapsed: float = time.perf_counter() - start
+
+    assert await mod.pl_size(voice_id) == imported + 1
+    assert await mod.pl_fetch(voice_id, limit=1, offset=imported) == \
+        [make(imported)]
+    logging.info('Imported %d songs in %fms', imported, elapsed * 1000)
+
+    # Exported playlists can be imported back
+    lines: list[bytes] = [
+        line async for line in mod.pl_export(voice_id, imported - 9)]
+    assert len(lines) == 10
+
+    other: int = voice_id + 1
+    assert await mod.pl_import(
+        other, (mod.pl_decode(line) for line in lines)) == 10
+    assert await mod.pl_fetch(other, limit=10, offset=0) == \
+        [make(x) for x in range(imported - 9, imported + 1)]
+
+    # Empty imports don't create the playlist
+    empty: int = other + 1
+    assert await mod.pl_import(empty, iter(())) == 0
+    assert await mod.pl_size(empty) is None
+
+    await mod.pl_clean(voice_id)
+    await mod.pl_clean(other)
+    logging.info('Playlist test ran correctly with %d songs', 2 * size)
+
+
+test_module: str = 'UStorage'
+steps: dict[str, Optional[callable]] = {
+    'post_install': test_post_install
+}